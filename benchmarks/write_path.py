@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the write path that need neither MySQL nor PostgreSQL.
+
+Every scenario builds a spider with ``after_start``, whose databases are SQLite files
+behind a manager that waits ``--latency`` seconds before each query like a network
+round trip, and sends its results through ruia's ``process_callback_result``. The
+``both`` scenario registers two of them as the MYSQL and POSTGRES backends.
+
+Run from the repository root::
+
+    python -m benchmarks.write_path --items 5000 --latency 0.001
+    python -m benchmarks.write_path --options '{"batch": {"size": 500}}' --json new.json
+    python -m benchmarks.write_path --json new.json --compare old.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tracemalloc
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List, Sequence
+
+from peewee import CharField, IntegerField
+
+from ruia_peewee_async import (
+    RuiaPeeweeInsert,
+    RuiaPeeweeUpdate,
+    Spider,
+    TargetDB,
+    after_start,
+    before_stop,
+    create_model,
+)
+from ruia_peewee_async.backend import Backend
+from ruia_peewee_async.sqlite import SqliteManager
+
+SCENARIOS = ("insert", "filtered_insert", "update", "both")
+
+
+class LatencyManager(SqliteManager):
+    """A SqliteManager whose every query first waits ``latency`` seconds."""
+
+    def __init__(self, database, latency: float = 0.0, **kwargs) -> None:
+        super().__init__(database, **kwargs)
+        self.latency = latency
+
+    async def _run(self, func, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await super()._run(func, *args, **kwargs)
+
+
+class BenchmarkSpider(Spider):
+    start_urls = ["http://localhost/"]
+
+
+def _model_config(directory: str, name: str) -> Dict:
+    return {
+        "database": os.path.join(directory, f"{name}.db"),
+        "model": {
+            "table_name": "benchmark",
+            "title": CharField(),
+            "url": CharField(unique=True),
+            "rank": IntegerField(),
+        },
+    }
+
+
+def _row(index: int) -> Dict:
+    return {
+        "title": f"title {index}",
+        "url": f"https://example.com/{index}",
+        "rank": index,
+    }
+
+
+def _results(scenario: str, items: int) -> List:
+    if scenario == "insert":
+        return [RuiaPeeweeInsert(_row(i), TargetDB.SQLITE) for i in range(items)]
+    if scenario == "filtered_insert":
+        return [
+            RuiaPeeweeInsert(_row(i), TargetDB.SQLITE, filters="url")
+            for i in range(items)
+        ]
+    if scenario == "update":
+        return [
+            RuiaPeeweeUpdate(
+                {"title": f"updated {i}"},
+                {"url": _row(i)["url"]},
+                TargetDB.SQLITE,
+                not_update_when_exists=False,
+            )
+            for i in range(items)
+        ]
+    return [RuiaPeeweeInsert(_row(i), TargetDB.BOTH) for i in range(items)]
+
+
+def _seed(backend: Backend, rows: Sequence[Dict]) -> None:
+    database = backend.model._meta.database  # pylint: disable=protected-access
+    with database.atomic():
+        for start in range(0, len(rows), 500):
+            backend.model.insert_many(rows[start : start + 500]).execute()
+
+
+async def _spider(directory: str, scenario: str, latency: float, options: Dict):
+    spider_ins = BenchmarkSpider(loop=asyncio.get_event_loop(), is_async_start=True)
+    # Only the warnings are logged, formatting every Report isn't what's measured.
+    spider_ins.logger.setLevel(logging.WARNING)
+    await after_start(sqlite=_model_config(directory, "sqlite"), **options)(spider_ins)
+    backend = spider_ins.backends["sqlite"]
+    await backend.manager.close()
+    backend.manager = spider_ins.sqlite_manager = LatencyManager(
+        backend.database, latency
+    )
+    if scenario == "both":
+        for name in ("mysql", "postgres"):
+            model, manager = create_model(
+                create_table=True, sqlite=_model_config(directory, name)
+            )
+            await manager.close()
+            database = model._meta.database  # pylint: disable=protected-access
+            spider_ins.backends[name] = Backend(
+                name, "sqlite", model, LatencyManager(database, latency)
+            )
+    return spider_ins
+
+
+def _percentile(values: Sequence[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def _setup(
+    directory: str, scenario: str, items: int, latency: float, options: Dict
+):
+    """The spider of a scenario, with the rows it filters or updates seeded."""
+    spider_ins = await _spider(directory, scenario, latency, options)
+    backend = spider_ins.backends["sqlite"]
+    if scenario == "filtered_insert":
+        _seed(backend, [_row(i) for i in range(0, items, 2)])
+    elif scenario == "update":
+        _seed(backend, [_row(i) for i in range(items)])
+    return spider_ins
+
+
+async def _measure(spider_ins, results: List, concurrency: int, trace: bool) -> Dict:
+    """Write the results and stop the spider, timing each item and the whole run."""
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(callback_result):
+        async with semaphore:
+            start = perf_counter()
+            await spider_ins.process_callback_result(callback_result)
+            latencies.append(perf_counter() - start)
+
+    if trace:
+        tracemalloc.start()
+    start = perf_counter()
+    await asyncio.gather(*(process(result) for result in results))
+    await before_stop(spider_ins)
+    elapsed = perf_counter() - start
+    allocations = {}
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocations = {"alloc_peak_kib": peak / 1024, "alloc_kib": current / 1024}
+    await spider_ins.request_session.close()
+    return {
+        "items_per_sec": len(results) / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        **allocations,
+    }
+
+
+def _check(spider_ins, scenario: str, items: int) -> None:
+    """Raise unless the scenario wrote every item."""
+    expected = {"both": ("mysql", "postgres")}.get(scenario, ("sqlite",))
+    for name in expected:
+        rows = spider_ins.backends[name].model.select().count()
+        if rows != items:
+            raise RuntimeError(f"{scenario} wrote {rows} rows to {name}, not {items}")
+    if scenario == "update":
+        model = spider_ins.backends["sqlite"].model
+        updated = model.select().where(model.title.startswith("updated")).count()
+        if updated != items:
+            raise RuntimeError(f"update updated {updated} rows, not {items}")
+
+
+async def run(
+    scenario: str,
+    items: int = 2000,
+    concurrency: int = 32,
+    latency: float = 0.0,
+    options: Dict = None,
+    trace: bool = False,
+) -> Dict:
+    """Run a scenario once, with tracemalloc tracing the allocations if ``trace``.
+
+    The items are written concurrently, at most ``concurrency`` at a time as with
+    ruia's workers, and the time to flush them at stop is included.
+    """
+    with TemporaryDirectory() as directory:
+        spider_ins = await _setup(directory, scenario, items, latency, options or {})
+        result = await _measure(
+            spider_ins, _results(scenario, items), concurrency, trace
+        )
+        _check(spider_ins, scenario, items)
+    return result
+
+
+async def run_all(
+    scenarios: Sequence[str],
+    items: int,
+    concurrency: int,
+    latency: float,
+    options: Dict,
+    allocations: bool = True,
+) -> Dict[str, Dict]:
+    """The timings of each scenario, and its allocations measured in a second run."""
+    report = {}
+    for scenario in scenarios:
+        report[scenario] = await run(scenario, items, concurrency, latency, options)
+        if allocations:
+            traced = await run(
+                scenario, items, concurrency, latency, options, trace=True
+            )
+            report[scenario].update(
+                {key: val for key, val in traced.items() if key.startswith("alloc")}
+            )
+    return report
+
+
+def _format(report: Dict[str, Dict]) -> str:
+    columns = ("items_per_sec", "p50_ms", "p99_ms", "alloc_peak_kib", "alloc_kib")
+    lines = [f"{'scenario':<16}" + "".join(f"{column:>16}" for column in columns)]
+    for scenario, result in report.items():
+        lines.append(
+            f"{scenario:<16}"
+            + "".join(
+                f"{result[column]:>16.2f}" if column in result else f"{'-':>16}"
+                for column in columns
+            )
+        )
+    return "\n".join(lines)
+
+
+def compare(report: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float):
+    """Print the changes from a baseline, returns the scenarios whose throughput regressed."""
+    regressed = []
+    for scenario, result in report.items():
+        before = baseline.get(scenario)
+        if not before:
+            continue
+        ratio = result["items_per_sec"] / before["items_per_sec"]
+        print(
+            f"{scenario:<16} items/sec {ratio - 1:+.1%}, "
+            f"p99 {before['p99_ms']:.2f}ms -> {result['p99_ms']:.2f}ms"
+        )
+        if ratio < 1 - tolerance:
+            regressed.append(scenario)
+    return regressed
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every query"
+    )
+    parser.add_argument(
+        "--options", type=json.loads, default={}, help="after_start options as JSON"
+    )
+    parser.add_argument("--no-allocations", action="store_true")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="a previous --json file to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="the items/sec drop from --compare that fails the run",
+    )
+    args = parser.parse_args(argv)
+    report = asyncio.run(
+        run_all(
+            args.scenario or SCENARIOS,
+            args.items,
+            args.concurrency,
+            args.latency,
+            args.options,
+            not args.no_allocations,
+        )
+    )
+    print(_format(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "items": args.items,
+                    "concurrency": args.concurrency,
+                    "latency": args.latency,
+                    "options": args.options,
+                    "results": report,
+                },
+                file,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressed = compare(report, baseline, args.tolerance)
+        if regressed:
+            print(f"throughput regressed in {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
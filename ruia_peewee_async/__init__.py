@@ -1,166 +1,381 @@
 # -*- coding: utf-8 -*-
-from enum import Enum
-from functools import wraps
-from ssl import SSLContext
+import asyncio
+import pickle
+from functools import partial, wraps
 from types import MethodType
-from typing import Callable, Dict
+from typing import Dict
 from typing import Optional as TOptional
 from typing import Sequence, Tuple, Union
 
-from peewee import DoesNotExist, Model, Query
-from peewee_async import (
-    AsyncQueryWrapper,
-    Manager,
-    MySQLDatabase,
-    PooledMySQLDatabase,
-    PooledPostgresqlDatabase,
-    PostgresqlDatabase,
+from peewee import DoesNotExist, Query
+from schema import Or, Schema, SchemaError
+
+from .backend import Backend, shard_of
+from .batches import _bulk_buffer, _insert_buffer, _update_buffer
+from .bloom import BloomFilter
+from .buffer import conflict_target
+from .config import (
+    OPTIONS,
+    check_config,
+    check_options,
+    database_schema,
+    sqlite_schema,
 )
-from pymysql import OperationalError
-from ruia import Spider as RuiaSpider
-from schema import And, Optional, Or, Schema, SchemaError, Use
-
-
-class Spider(RuiaSpider):
-    mysql_model: Model
-    mysql_manager: Manager
-    postgres_model: Model
-    postgres_manager: Manager
-    mysql_db: Union[MySQLDatabase, PooledMySQLDatabase]
-    postgres_db: Union[PostgresqlDatabase, PooledPostgresqlDatabase]
-    mysql_filters: TOptional[AsyncQueryWrapper]
-    postgres_filters: TOptional[AsyncQueryWrapper]
-    process_insert_callback_result: Callable
-    process_update_callback_result: Callable
+from .database import _replica, create_model
+from .dispatch import (
+    CONNECTION_ERRORS,
+    _backend,
+    _backend_model,
+    _call,
+    _create,
+    _read,
+    _save,
+    _stage,
+)
+from .filters import _is_filtered, _remember, filter_func
+from .lifecycle import (
+    FEATURES,
+    _pool_size,
+    _profile_on_signal,
+    close_spider,
+    prewarm_bloom_filters,
+    setup_spider,
+)
+from .metrics import Metrics
+from .report import (
+    BUFFERED,
+    CREATED,
+    FILTERED,
+    INSERTED,
+    SKIPPED,
+    SPOOLED,
+    UPDATED,
+    UPSERTED,
+    Report,
+    SummaryReporter,
+)
+from .retry import is_transient
+from .spider import TARGET_DATABASES, Spider, TargetDB
+from .validation import (
+    INSERT_RESULT_TYPES,
+    UPDATE_RESULT_TYPES,
+    _validate_result,
+    result_validator,
+)
+from .writer import WriteQueue
+
+
+def _target_databases(database, backends=None) -> Tuple[str, ...]:
+    if backends:
+        if isinstance(backends, str):
+            backends = [backends]
+        return tuple(name.upper() for name in backends)
+    # Anything that isn't a TargetDB is reported by the result validation.
+    if isinstance(database, TargetDB):
+        return TARGET_DATABASES[database]
+    return ()
+
+
+def _route_shards(spider_ins: Spider, databases, data, query=None) -> Tuple[str, ...]:
+    """Replace the target databases with the shard of the sharding key's value.
+
+    With sharded ``backends`` every row goes to one of them, with sharded ``tables``
+    each target database writes to one of its suffixed tables.
+    """
+    sharding_config = getattr(spider_ins, "sharding_config", None)
+    if sharding_config is None:
+        return databases
+    key = sharding_config["key"]
+    value = data.get(key)
+    if value is None and isinstance(query, dict):
+        value = query.get(key)
+    if value is None:
+        raise SchemaError(
+            f"<RuiaPeeweeAsync: data: {data} has no sharding key {key} to route on>"
+        )
+    if "backends" in sharding_config:
+        backends = sharding_config["backends"]
+        return (backends[shard_of(value, len(backends))].upper(),)
+    shard = shard_of(value, sharding_config["tables"])
+    return tuple(f"{database}_{shard}" for database in databases)
 
 
-class TargetDB(Enum):
-    MYSQL = 0
-    POSTGRES = 1
-    BOTH = 2
+def _normalize_filters(filters):
+    return [filters] if isinstance(filters, str) else filters
 
 
 def logging(func):
     @wraps(func)
     async def decorator(spider_ins: Spider, callback_result):
-        data = callback_result.data
-        database = callback_result.database
-        query = getattr(callback_result, "query", None)
         try:
-            result = await func(spider_ins, callback_result)
-        except OperationalError as ope:  # pragma: no cover
-            method = "insert" if not query else "update"
-            spider_ins.logger.error(
-                f"<RuiaPeeweeAsync: {database.name} {method} data: {data} error: {ope}>"
-            )
-        except SchemaError as pae:
-            spider_ins.logger.error(pae)
-            raise pae
-        else:
-            spider_ins.logger.info(result)
+            with _stage(spider_ins, "item"):
+                try:
+                    result = await func(spider_ins, callback_result)
+                except CONNECTION_ERRORS:  # pragma: no cover
+                    # _fan_out logged and counted the error of each backend written to.
+                    pass
+                except SchemaError as pae:
+                    spider_ins.logger.error(pae)
+                    raise pae
+                else:
+                    with _stage(spider_ins, "logging"):
+                        reporter = getattr(spider_ins, "reporter", None)
+                        if reporter is not None:
+                            reporter.record(result)
+                        else:
+                            # The Report is only formatted if INFO is enabled.
+                            spider_ins.logger.info(result)
+        finally:
+            profiler = getattr(spider_ins, "profiler", None)
+            if profiler is not None:
+                profiler.item_done()
 
     return decorator
 
 
-def _raise_no_attr(target, fields, pre_msg):
-    for field in fields:
-        if hasattr(target, field):
-            continue
-        raise SchemaError(
-            f"<{pre_msg} error: callback_result should have {field} attribute>"
+async def _spooling(spider_ins: Spider, database: str, coroutine, record: Tuple):
+    """Await the write of one database, spooling its ``record`` when the database is unavailable."""
+    spool = getattr(spider_ins, "spool", None)
+    if spool is None:
+        return await coroutine
+    try:
+        return await coroutine
+    except CONNECTION_ERRORS as exc:
+        # A write failing for good would stop every replay.
+        if not is_transient(exc):
+            raise
+        try:
+            spool.append(record)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            raise exc from None
+        return (
+            Report()
+            .count(database, SPOOLED)
+            .add(
+                "<RuiaPeeweeAsync: {} unavailable: {}, spooled data: {}>",
+                database.upper(),
+                exc,
+                record[2],
+            )
         )
 
 
-def _check_result(data: Tuple):
-    target, type_dict, pre_msg = data
-    type_dict: Dict
-    _raise_no_attr(target, type_dict.keys(), pre_msg)
-    for name, vtype in type_dict.items():
-        msg = f"<{pre_msg} error: callback_result's {name} should be a {vtype}>"
-        attr = getattr(target, name)
-        if name in ["data", "query"] and not attr:
-            raise SchemaError(f"<{pre_msg} error: {name} cannot be empty>")
-        if not isinstance(attr, vtype):
-            raise SchemaError(msg)
+async def _apply_spooled(spider_ins: Spider, record: Tuple):
+    """Write a spooled record, the unavailable database errors are raised."""
+    kind = record[0]
+    if kind == "result":
+        # A callback result the full write queue turned away, it's routed again.
+        if isinstance(record[2], RuiaPeeweeInsert):
+            await RuiaPeeweeInsert.process(spider_ins, record[2])
+        else:
+            await RuiaPeeweeUpdate.process(spider_ins, record[2])
+        return
+    if kind == "insert":
+        write = RuiaPeeweeInsert._insert  # pylint: disable=protected-access
+    else:
+        write = RuiaPeeweeUpdate._update_one  # pylint: disable=protected-access
+    report = await write(spider_ins, *record[1:])
+    reporter = getattr(spider_ins, "reporter", None)
+    if reporter is not None:
+        reporter.record(report)
+    elif report:
+        spider_ins.logger.info(report)
 
 
-result_validator = Schema(Use(_check_result))
+def _spool_result(spider_ins: Spider, callback_result):
+    spider_ins.spool.append(("result", None, callback_result))
 
 
-async def filter_func(data, manager, model, filters) -> bool:
-    conditions = [getattr(model, fil) for fil in filters]
-    query = {x.name: data[x.name] for x in conditions}
-    try:
-        await manager.get(model, **query)
-    except DoesNotExist:
-        return False
-    else:
-        return True
+def _unavailable(exc: BaseException) -> bool:
+    """Whether a write failed because its database is unavailable, and may succeed later."""
+    return isinstance(exc, CONNECTION_ERRORS) and is_transient(exc)
+
+
+async def replay_spool(spider_ins: Spider):
+    """Replay the spooled writes every ``replay_interval`` seconds."""
+    spool_config = spider_ins.spool_config
+    while True:
+        await spider_ins.spool.replay(
+            partial(_apply_spooled, spider_ins),
+            _unavailable,
+            spool_config.get("batch", 100),
+        )
+        await asyncio.sleep(spool_config.get("replay_interval", 5.0))
+
+
+async def _fan_out(spider_ins: Spider, method: str, data, databases, coroutines):
+    """Run the work of each database concurrently.
+
+    An OperationalError of one database is logged and counted under the name of the
+    backend written to, without stopping the others. It's only raised when every database failed.
+    Returns the results of the databases that succeeded keyed by their names.
+    """
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    outcomes = {}
+    errors = []
+    for database, result in zip(databases, results):
+        if isinstance(result, CONNECTION_ERRORS):
+            errors.append(result)
+            spider_ins.logger.error(
+                f"<RuiaPeeweeAsync: {database} {method} data: {data} error: {result}>"
+            )
+            reporter = getattr(spider_ins, "reporter", None)
+            if reporter is not None:
+                reporter.error(database)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            outcomes[database] = result
+    if errors and not outcomes:
+        raise errors[0]
+    return outcomes
 
 
 class RuiaPeeweeInsert:
+    __slots__ = ("data", "database", "databases", "filters", "backends", "model")
+
     def __init__(
         self,
         data: Dict,
         database: TargetDB = TargetDB.MYSQL,
         filters: TOptional[Union[Sequence[str], str]] = None,
+        backends: TOptional[Union[Sequence[str], str]] = None,
+        model: TOptional[str] = None,
     ) -> None:
         """
 
         Args:
             data: A data that's going to be inserted into the database.
             database: The target database type.
+            filters: A str or List[str] of columns to avoid duplicate data, a str is turned into a list.
+            backends: A name or names of the backends configured in after_start, used instead of database.
+            model: A name of the config's models to insert into instead of its model.
 
         """
 
         self.data = data
         self.database = database
-        self.filters = filters
+        self.backends = backends
+        self.model = model
+        self.databases = _target_databases(database, backends)
+        self.filters = _normalize_filters(filters)
 
     @staticmethod
     @logging
     async def process(spider_ins: Spider, callback_result):
-        needs_check = (
-            callback_result,
-            {"data": dict, "database": TargetDB, "filters": (str, type(None), list)},
-            "RuiaPeeweeAsync: insert process",
-        )
-        result_validator.validate(needs_check)
+        with _stage(spider_ins, "validation"):
+            _validate_result(
+                spider_ins,
+                callback_result,
+                INSERT_RESULT_TYPES,
+                "RuiaPeeweeAsync: insert process",
+            )
         data = callback_result.data
-        database = callback_result.database
-        filters = callback_result.filters
-        if database == TargetDB.BOTH:
-            databases = [TargetDB.MYSQL.name, TargetDB.POSTGRES.name]
-        else:
-            databases = [database.name]
-        msg = ""
-        if isinstance(filters, str):
-            filters = [filters]
-        for database in databases:
-            database = database.lower()
-            manager: Manager = getattr(spider_ins, f"{database}_manager")
-            model: Model = getattr(spider_ins, f"{database}_model")
-            if filters:
-                filtered = await filter_func(data, manager, model, filters)
-                if filtered:
-                    msg += (
-                        f"<RuiaPeeweeAsync: data: {data} was filtered by filters: {filters},"
-                        f" won't insert into {database.upper()}>\n"
-                    )
-                    continue
-                msg += (
-                    f"<RuiaPeeweeAsync: data: {data} wasn't filtered by filters: {filters}, "
-                    f"success insert into {database.upper()}>\n"
+        # Results that aren't a RuiaPeeweeInsert aren't normalized yet.
+        databases = getattr(callback_result, "databases", None) or _target_databases(
+            callback_result.database
+        )
+        databases = _route_shards(spider_ins, databases, data)
+        filters = _normalize_filters(callback_result.filters)
+        model = getattr(callback_result, "model", None)
+        results = await _fan_out(
+            spider_ins,
+            "insert",
+            data,
+            databases,
+            [
+                _spooling(
+                    spider_ins,
+                    database,
+                    RuiaPeeweeInsert._insert(
+                        spider_ins, database.lower(), data, filters, model
+                    ),
+                    ("insert", database.lower(), data, filters, model),
+                )
+                for database in databases
+            ],
+        )
+        report = Report()
+        for part in results.values():
+            report.extend(part)
+        if report:
+            return report
+        if any(outcome == BUFFERED for _, outcome in report.outcomes):
+            return report.add(
+                "<RuiaPeeweeAsync: Buffered {} for batch insert into database: {}>",
+                data,
+                list(results),
+            )
+        return report.add(
+            "<RuiaPeeweeAsync: Success insert {} into database: {}>",
+            data,
+            list(results),
+        )
+
+    @staticmethod
+    async def _insert(
+        spider_ins: Spider, database: str, data, filters, model_name=None
+    ) -> Report:
+        backend = _backend(spider_ins, database)
+        manager, model = backend.manager, _backend_model(backend, model_name)
+        # Items with filters are checked one by one, so they keep using INSERT.
+        buffer = None if filters else _bulk_buffer(spider_ins, database, manager, model)
+        if buffer is None:
+            buffer = _insert_buffer(spider_ins, database, manager, model)
+        report = Report()
+        if filters:
+            with _stage(spider_ins, "filter", database):
+                filtered = await _is_filtered(
+                    spider_ins, database, manager, model, data, filters
                 )
-            await manager.create(model, **data)
-        if msg:
-            return msg
-        return f"<RuiaPeeweeAsync: Success insert {data} into database: {databases}>"
+            if filtered:
+                report.count(database, FILTERED).add(
+                    "<RuiaPeeweeAsync: data: {} was filtered by filters: {},"
+                    " won't insert into {}>",
+                    data,
+                    filters,
+                    database.upper(),
+                )
+                return report
+            report.add(
+                "<RuiaPeeweeAsync: data: {} wasn't filtered by filters: {}, "
+                "success insert into {}>",
+                data,
+                filters,
+                database.upper(),
+            )
+        report.count(database, INSERTED if buffer is None else BUFFERED)
+        with _stage(spider_ins, "write", database):
+            if buffer is not None:
+                # The buffer remembers the keys of the rows it has written.
+                await buffer.add(data, filters)
+                return report
+            with spider_ins.metrics.timer(database, "create"):
+                await _call(
+                    spider_ins,
+                    database,
+                    lambda: _create(spider_ins, manager, model, data),
+                )
+        _remember(spider_ins, database, model, data, filters)
+        return report
 
 
-class RuiaPeeweeUpdate:
+class RuiaPeeweeUpdate:  # pylint: disable=too-many-instance-attributes
     """Ruia Peewee Update Class"""
 
+    __slots__ = (
+        "data",
+        "query",
+        "database",
+        "databases",
+        "filters",
+        "create_when_not_exists",
+        "not_update_when_exists",
+        "only",
+        "backends",
+        "model",
+    )
+
     def __init__(
         self,
         data: Dict,
@@ -170,6 +385,8 @@ class RuiaPeeweeUpdate:
         create_when_not_exists: bool = True,
         not_update_when_exists: bool = True,
         only: TOptional[Sequence[str]] = None,
+        backends: TOptional[Union[Sequence[str], str]] = None,
+        model: TOptional[str] = None,
     ) -> None:
         """
 
@@ -180,17 +397,22 @@ class RuiaPeeweeUpdate:
             filters: A str or List[str] of columns to avoid duplicate data and avoid unnecessary query execute.
             create_when_not_exists: Default is True. If True, will create a record when query can't get the record.
             not_update_when_exists: Default is True. If True and record exists, won't update data to the records.
-            only: A list or tuple of fields that should be updated only.
+            only: A list or tuple of fields that should be updated only, it's stored as a tuple.
+            backends: A name or names of the backends configured in after_start, used instead of database.
+            model: A name of the config's models to update instead of its model.
 
         """
 
         self.data = data
         self.query = query
         self.database = database
-        self.filters = filters
+        self.backends = backends
+        self.databases = _target_databases(database, backends)
+        self.filters = _normalize_filters(filters)
         self.create_when_not_exists = create_when_not_exists
         self.not_update_when_exists = not_update_when_exists
-        self.only = only
+        self.only = tuple(only) if isinstance(only, list) else only
+        self.model = model
 
     @staticmethod
     async def _deal_update(
@@ -202,42 +424,248 @@ class RuiaPeeweeUpdate:
         not_update_when_exists,
         only,
         databases,
-    ):  # pylint: disable=too-many-locals
-        msg = ""
-        if isinstance(filters, str):
-            filters = [filters]
-        for database in databases:
-            database = database.lower()
-            manager: Manager = getattr(spider_ins, f"{database}_manager")
-            model: Model = getattr(spider_ins, f"{database}_model")
-            if filters:
-                filtered = await filter_func(data, manager, model, filters)
-                if filtered:
-                    msg += f"<RuiaPeeweeAsync: data: {data} was filtered by filters: {filters}\n"
-                    continue
-                msg += f"<RuiaPeeweeAsync: data: {data} wasn't filtered by filters: {filters}\n"
-            try:
-                model_ins = await manager.get(model, **query)
-            except DoesNotExist:
-                if create_when_not_exists:
-                    await manager.create(model, **data)
-                    msg += f"<RuiaPeeweeAsync: data: {data} not exists in {database.upper()}, but success created>\n"
-                msg += (
-                    f"<RuiaPeeweeAsync: data: {data} not exists in {database.upper()}, "
-                    "won't create it because create_when_not_exists is False>\n"
+        model=None,
+    ):
+        filters = _normalize_filters(filters)
+        results = await _fan_out(
+            spider_ins,
+            "update",
+            data,
+            databases,
+            [
+                _spooling(
+                    spider_ins,
+                    database,
+                    RuiaPeeweeUpdate._update_one(
+                        spider_ins,
+                        database.lower(),
+                        data,
+                        query,
+                        filters,
+                        create_when_not_exists,
+                        not_update_when_exists,
+                        only,
+                        model,
+                    ),
+                    (
+                        "update",
+                        database.lower(),
+                        data,
+                        query,
+                        filters,
+                        create_when_not_exists,
+                        not_update_when_exists,
+                        only,
+                        model,
+                    ),
                 )
-            else:
-                if not_update_when_exists:
-                    msg += (
-                        f"<RuiaPeeweeAsync: Won't update {data} in {database.upper()} "
-                        "because not_update_when_exists is True>\n"
+                for database in databases
+            ],
+        )
+        report = Report()
+        for part in results.values():
+            report.extend(part)
+        if report:
+            return report
+        return report.add("<RuiaPeeweeAsync: Updated {} in {}>", data, list(results))
+
+    @staticmethod
+    async def _update_one(
+        spider_ins,
+        database,
+        data,
+        query,
+        filters,
+        create_when_not_exists,
+        not_update_when_exists,
+        only,
+        model_name=None,
+    ) -> Report:
+        report = Report()
+        backend = _backend(spider_ins, database)
+        model = _backend_model(backend, model_name)
+        if filters:
+            with _stage(spider_ins, "filter", database):
+                filtered = await _is_filtered(
+                    spider_ins, database, backend.manager, model, data, filters
+                )
+            if filtered:
+                return report.count(database, FILTERED).add(
+                    "<RuiaPeeweeAsync: data: {} was filtered by filters: {}",
+                    data,
+                    filters,
+                )
+            report.add(
+                "<RuiaPeeweeAsync: data: {} wasn't filtered by filters: {}",
+                data,
+                filters,
+            )
+        fields = RuiaPeeweeUpdate._update_fields(data, query, only)
+        if (
+            getattr(spider_ins, "update_batch_config", None) is not None
+            and isinstance(query, dict)
+            and not not_update_when_exists
+            and fields
+        ):
+            await RuiaPeeweeUpdate._buffer_update(
+                spider_ins,
+                database,
+                backend,
+                model,
+                data,
+                query,
+                fields,
+                create_when_not_exists,
+            )
+            return report.count(database, BUFFERED).add(
+                "<RuiaPeeweeAsync: Buffered {} for batch update in {}>",
+                data,
+                database.upper(),
+            )
+        if getattr(spider_ins, "upsert_config", False) and isinstance(query, dict):
+            if not await RuiaPeeweeUpdate._upsert(
+                spider_ins,
+                database,
+                backend,
+                model,
+                data,
+                RuiaPeeweeUpdate._upsert_query(
+                    model,
+                    data,
+                    query,
+                    create_when_not_exists,
+                    not_update_when_exists,
+                    only,
+                ),
+            ):
+                return report.count(database, SKIPPED).add(
+                    "<RuiaPeeweeAsync: Won't upsert {} in {} "
+                    "because the options leave nothing to write>",
+                    data,
+                    database.upper(),
+                )
+            return report.count(database, UPSERTED).add(
+                "<RuiaPeeweeAsync: Upserted {} in {}>", data, database.upper()
+            )
+        try:
+            with _stage(spider_ins, "lookup", database), spider_ins.metrics.timer(
+                database, "get", expected=DoesNotExist
+            ):
+                model_ins = await _call(
+                    spider_ins,
+                    database,
+                    lambda: _read(
+                        spider_ins, backend, lambda reader: reader.get(model, **query)
+                    ),
+                    breaker=backend.replica is None,
+                )
+        except DoesNotExist:
+            if create_when_not_exists:
+                with _stage(spider_ins, "write", database), spider_ins.metrics.timer(
+                    database, "create"
+                ):
+                    await _call(
+                        spider_ins,
+                        database,
+                        lambda: _create(spider_ins, backend.manager, model, data),
                     )
-                    continue
-                model_ins.__data__.update(data)
-                await manager.update(model_ins, only=only)
-        if msg:
-            return msg
-        return f"<RuiaPeeweeAsync: Updated {data} in {databases}>"
+                _remember(spider_ins, database, model, data, filters)
+                report.count(database, CREATED).add(
+                    "<RuiaPeeweeAsync: data: {} not exists in {}, but success created>",
+                    data,
+                    database.upper(),
+                )
+            else:
+                report.count(database, SKIPPED)
+            report.add(
+                "<RuiaPeeweeAsync: data: {} not exists in {}, "
+                "won't create it because create_when_not_exists is False>",
+                data,
+                database.upper(),
+            )
+        else:
+            if not_update_when_exists:
+                return report.count(database, SKIPPED).add(
+                    "<RuiaPeeweeAsync: Won't update {} in {} "
+                    "because not_update_when_exists is True>",
+                    data,
+                    database.upper(),
+                )
+            model_ins.__data__.update(data)
+            with _stage(spider_ins, "write", database), spider_ins.metrics.timer(
+                database, "update"
+            ):
+                await _call(
+                    spider_ins,
+                    database,
+                    lambda: _save(spider_ins, backend.manager, model_ins, only),
+                )
+            _remember(spider_ins, database, model, data, filters)
+            report.count(database, UPDATED)
+        return report
+
+    @staticmethod
+    async def _buffer_update(
+        spider_ins, database, backend, model, data, query, fields, create
+    ) -> None:
+        """Add the update to the batch of its columns, with the whole row if it creates."""
+        buffer = _update_buffer(
+            spider_ins, database, backend.manager, model, tuple(query), fields, create
+        )
+        with _stage(spider_ins, "write", database):
+            if create:
+                await buffer.add({**query, **data})
+            else:
+                await buffer.add({**query, **{name: data[name] for name in fields}})
+
+    @staticmethod
+    async def _upsert(spider_ins, database, backend, model, data, upsert) -> bool:
+        """Run the upsert statement, returns False when there's none to run."""
+        if upsert is None:
+            return False
+        with _stage(spider_ins, "write", database):
+            with spider_ins.metrics.timer(database, "upsert"):
+                await _call(
+                    spider_ins, database, lambda: backend.manager.execute(upsert)
+                )
+        # Whether a row was written isn't known here, so only the
+        # Bloom filter, which tolerates false positives, learns the key.
+        _remember(spider_ins, database, model, data, None)
+        return True
+
+    @staticmethod
+    def _update_fields(data, query, only) -> Tuple[str, ...]:
+        """The columns an update writes, the query columns identify the row."""
+        return tuple(
+            name for name in (only or data) if name in data and name not in query
+        )
+
+    @staticmethod
+    def _upsert_query(
+        model, data, query, create_when_not_exists, not_update_when_exists, only
+    ):
+        """Compile the update options into a single statement keyed on the query columns.
+
+        The query columns need a unique index for the conflict to be detected.
+        Returns None when the options leave nothing to do.
+        """
+        fields = RuiaPeeweeUpdate._update_fields(data, query, only)
+        if not create_when_not_exists:
+            if not_update_when_exists or not fields:
+                return None
+            conditions = [
+                getattr(model, name) == value for name, value in query.items()
+            ]
+            return model.update({name: data[name] for name in fields}).where(
+                *conditions
+            )
+        insert = model.insert(**{**query, **data})
+        if not_update_when_exists or not fields:
+            return insert.on_conflict_ignore()
+        return insert.on_conflict(
+            conflict_target=conflict_target(model, query),
+            preserve=[getattr(model, name) for name in fields],
+        )
 
     @staticmethod
     async def _update(
@@ -245,15 +673,13 @@ class RuiaPeeweeUpdate:
         data,
         query,
         filters,
-        database,
+        databases,
         create_when_not_exists,
         not_update_when_exists,
         only,
+        model=None,
     ):
-        if database == TargetDB.BOTH:
-            databases = [TargetDB.MYSQL.name, TargetDB.POSTGRES.name]
-        else:
-            databases = [database.name]
+        databases = _route_shards(spider_ins, databases, data, query)
         result = await RuiaPeeweeUpdate._deal_update(
             spider_ins,
             data,
@@ -263,6 +689,7 @@ class RuiaPeeweeUpdate:
             not_update_when_exists,
             only,
             databases,
+            model,
         )
         return result
 
@@ -270,213 +697,124 @@ class RuiaPeeweeUpdate:
     @logging
     async def process(spider_ins, callback_result):
         data = callback_result.data
-        database = callback_result.database
+        databases = getattr(callback_result, "databases", None) or _target_databases(
+            callback_result.database
+        )
         query = callback_result.query
         filters = callback_result.filters
         create_when_not_exists = callback_result.create_when_not_exists
         not_update_when_exists = callback_result.not_update_when_exists
         only = callback_result.only
-        needs_check = (
-            callback_result,
-            {
-                "data": dict,
-                "database": TargetDB,
-                "query": (Query, dict),
-                "filters": (str, type(None), list),
-                "create_when_not_exists": bool,
-                "not_update_when_exists": bool,
-                "only": (list, tuple, type(None)),
-            },
-            "RuiaPeeweeAsync: update process",
-        )
-        result_validator.validate(needs_check)
+        model = getattr(callback_result, "model", None)
+        with _stage(spider_ins, "validation"):
+            _validate_result(
+                spider_ins,
+                callback_result,
+                UPDATE_RESULT_TYPES,
+                "RuiaPeeweeAsync: update process",
+            )
         result = await RuiaPeeweeUpdate._update(
             spider_ins,
             data,
             query,
             filters,
-            database,
+            databases,
             create_when_not_exists,
             not_update_when_exists,
             only,
+            model,
         )
         return result
 
 
-def init_spider(*, spider_ins: Spider):
-    mysql_config = getattr(spider_ins, "mysql_config", {})
-    postgres_config = getattr(spider_ins, "postgres_config", {})
-    create_model(
-        spider_ins=spider_ins,
-        create_table=True,
-        mysql=mysql_config,
-        postgres=postgres_config,
-    )
+def _init_writes(spider_ins: Spider):
+    """Route the callback results to the writes, through the write queue if there's one."""
     spider_ins.callback_result_map = spider_ins.callback_result_map or {}
-    spider_ins.process_insert_callback_result = MethodType(
-        RuiaPeeweeInsert.process, spider_ins
-    )
+    process_insert = MethodType(RuiaPeeweeInsert.process, spider_ins)
+    process_update = MethodType(RuiaPeeweeUpdate.process, spider_ins)
+    write_queue_config = getattr(spider_ins, "write_queue_config", None)
+    if write_queue_config is not None:
+        overflow = None
+        if (getattr(spider_ins, "spool_config", None) or {}).get("overflow"):
+            overflow = partial(_spool_result, spider_ins)
+        spider_ins.write_queue = WriteQueue(
+            spider_ins.logger,
+            **{"workers": _pool_size(spider_ins), **write_queue_config},
+        )
+        spider_ins.write_queue.start()
+        process_insert = spider_ins.write_queue.wrap(process_insert, overflow)
+        process_update = spider_ins.write_queue.wrap(process_update, overflow)
+    spider_ins.process_insert_callback_result = process_insert
     spider_ins.callback_result_map.update(
         {"RuiaPeeweeInsert": "process_insert_callback_result"}
     )
-    spider_ins.process_update_callback_result = MethodType(
-        RuiaPeeweeUpdate.process, spider_ins
-    )
+    spider_ins.process_update_callback_result = process_update
     spider_ins.callback_result_map.update(
         {"RuiaPeeweeUpdate": "process_update_callback_result"}
     )
 
 
-def check_config(kwargs) -> Sequence[Dict]:
-    # no_config_msg = """
-    #         RuiaPeeweeAsync must have a param named mysql_config or postgres_config or both, eg:
-    #         mysql_config = {
-    #             'user': 'yourusername',
-    #             'password': 'yourpassword',
-    #             'host': '127.0.0.1',
-    #             'port': 3306,
-    #             'database': 'ruia_mysql',
-    #             'model': {{
-    #                 'table_name': 'ruia_mysql_table',
-    #                 "title": CharField(),
-    #                 'url': CharField(),
-    #             }},
-    #         }
-    #         postgres_config = {
-    #             'user': 'yourusername',
-    #             'password': 'yourpassword',
-    #             'host': '127.0.0.1',
-    #             'port': 5432,
-    #             'database': 'ruia_postgres',
-    #             'model': {{
-    #                 'table_name': 'ruia_postgres_table',
-    #                 "title": CharField(),
-    #                 'url': CharField(),
-    #             }},
-    #         }
-    #         """
-    conf_validator = Schema(
-        {
-            Or("mysql", "postgres"): Or(
-                None,
-                And(
-                    {
-                        "host": And(str),
-                        "user": And(str),
-                        "password": And(str),
-                        "database": And(str),
-                        "model": And({"table_name": And(str), str: object}),
-                        Optional("port"): And(int),
-                        Optional("ssl"): And(SSLContext),
-                        Optional("pool"): And(bool),
-                        Optional("min_connections"): And(
-                            int, lambda mic: 1 <= mic <= 10
-                        ),
-                        Optional("max_connections"): And(
-                            int, lambda mac: 10 < mac <= 20
-                        ),
-                    }
-                ),
-            )
-        }
+async def _close_writes(spider_ins: Spider):
+    """Wait for the queued writes, then replay the spooled ones a last time."""
+    write_queue = getattr(spider_ins, "write_queue", None)
+    if write_queue is not None:
+        await write_queue.join()
+        spider_ins.logger.info(f"<RuiaPeeweeAsync: write queue: {write_queue.stats()}>")
+    spool = getattr(spider_ins, "spool", None)
+    if spool is None:
+        return
+    spool_task = getattr(spider_ins, "spool_task", None)
+    if spool_task is not None:
+        spool_task.cancel()
+        await asyncio.gather(spool_task, return_exceptions=True)
+    await spool.replay(
+        partial(_apply_spooled, spider_ins),
+        _unavailable,
+        spider_ins.spool_config.get("batch", 100),
     )
-    kwval = conf_validator.validate(kwargs)
-    mysql = kwval.get("mysql", {})
-    postgres = kwval.get("postgres", {})
-    mysql_model = mysql.get("model", None)
-    postgres_model = postgres.get("model", None)
-    return mysql, mysql_model, postgres, postgres_model
+
+
+# The writes are set up after every other feature and drained before any is torn down.
+HOOKS = (*FEATURES, (_init_writes, _close_writes))
+
+
+def init_spider(*, spider_ins: Spider):
+    setup_spider(spider_ins, HOOKS)
 
 
 def after_start(**kwargs):
-    mysql, mysql_model, postgres, postgres_model = check_config(kwargs)
+    options = check_options({key: kwargs.pop(key) for key in OPTIONS if key in kwargs})
+    sqlite = Schema(Or(None, sqlite_schema())).validate(kwargs.pop("sqlite", None))
+    if sqlite and not kwargs:
+        mysql, mysql_model, postgres, postgres_model = {}, None, {}, None
+    else:
+        mysql, mysql_model, postgres, postgres_model = check_config(kwargs)
 
     async def init_after_start(spider_ins):
 
+        for option, value in options.items():
+            setattr(spider_ins, f"{option}_config", value)
         if mysql and mysql_model:
             spider_ins.mysql_config = mysql
             # spider_ins.mysql_model = mysql_model
         if postgres and postgres_model:
             spider_ins.postgres_config = postgres
             # spider_ins.postgres_model = postgres_model
+        if sqlite:
+            spider_ins.sqlite_config = sqlite
         init_spider(spider_ins=spider_ins)
+        metrics_config = getattr(spider_ins, "metrics_config", None) or {}
+        if "port" in metrics_config:
+            spider_ins.metrics_server = await spider_ins.metrics.serve(
+                metrics_config.get("host", "127.0.0.1"), metrics_config["port"]
+            )
+        _profile_on_signal(spider_ins)
+        await prewarm_bloom_filters(spider_ins)
+        if getattr(spider_ins, "spool", None) is not None:
+            spider_ins.spool_task = asyncio.ensure_future(replay_spool(spider_ins))
 
     return init_after_start
 
 
 async def before_stop(spider_ins):
-    if hasattr(spider_ins, "postgres_manager"):
-        await spider_ins.postgres_manager.close()
-    if hasattr(spider_ins, "mysql_manager"):
-        await spider_ins.mysql_manager.close()
-
-
-def create_model(spider_ins=None, create_table=False, **kwargs) -> Tuple:
-    mysql, postgres = kwargs.get("mysql", {}), kwargs.get("postgres", {})
-    mysql_mconf = mysql.get("model", {})
-    postgres_mconf = postgres.get("model", {})
-    mysql_model, mysql_manager, postgres_model, postgres_manager = (
-        None,
-        None,
-        None,
-        None,
-    )
-    if mysql:
-        mysql_db = (
-            PooledMySQLDatabase(
-                **{
-                    key: val
-                    for key, val in mysql.items()
-                    if key not in ("model", "pool")
-                }
-            )
-            if "pool" in mysql
-            else MySQLDatabase(
-                **{key: val for key, val in mysql.items() if key != "model"}
-            )
-        )
-        mysql_manager = Manager(mysql_db)
-        meta = type("Meta", (object,), {"database": mysql_db})
-        table_name = mysql_mconf.pop("table_name")
-        mysql_mconf["Meta"] = meta
-        mysql_model = type(table_name, (Model,), mysql_mconf)
-        if spider_ins:
-            spider_ins.mysql_db = mysql_db
-            spider_ins.mysql_model = mysql_model
-            spider_ins.mysql_manager = mysql_manager
-        if create_table:
-            with mysql_manager.allow_sync():
-                mysql_model.create_table(True)
-        mysql_mconf["table_name"] = table_name
-    if postgres:
-        postgres_db = (
-            PooledPostgresqlDatabase(
-                **{
-                    key: val
-                    for key, val in postgres.items()
-                    if key not in ("model", "pool")
-                }
-            )
-            if "pool" in postgres
-            else PostgresqlDatabase(
-                **{key: val for key, val in postgres.items() if key != "model"}
-            )
-        )
-        postgres_manager = Manager(postgres_db)
-        meta = type("Meta", (object,), {"database": postgres_db})
-        table_name = postgres_mconf.pop("table_name")
-        postgres_mconf["Meta"] = meta
-        postgres_model = type(table_name, (Model,), postgres_mconf)
-        if spider_ins:
-            spider_ins.postgres_db = postgres_db
-            spider_ins.postgres_model = postgres_model
-            spider_ins.postgres_manager = postgres_manager
-        if create_table:
-            with postgres_manager.allow_sync():
-                postgres_model.create_table(True)
-        postgres_mconf["table_name"] = table_name
-    if mysql and not postgres:
-        return mysql_model, mysql_manager
-    if postgres and not mysql:
-        return postgres_model, postgres_manager
-    return mysql_model, mysql_manager, postgres_model, postgres_manager
+    await close_spider(spider_ins, HOOKS)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from hashlib import blake2b
+from typing import Dict, Optional
+
+from peewee import Model
+from peewee_async import Manager
+
+
+class Backend:
+    """A named database a spider writes to."""
+
+    __slots__ = (
+        "name",
+        "kind",
+        "model",
+        "manager",
+        "replica",
+        "fallback",
+        "models",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        model: Model,
+        manager: Manager,
+        replica: Optional[Manager] = None,
+        fallback: bool = True,
+        models: Optional[Dict[str, Model]] = None,
+    ) -> None:
+        """
+
+        Args:
+            name: The name results use to target the backend, in lower case.
+            kind: Either "mysql", "postgres" or "sqlite".
+            model: The peewee model written to when a result names none.
+            manager: The peewee-async manager of the database.
+            replica: The manager of a read replica that serves the filter lookups.
+            fallback: Whether reads go to the primary when the replica fails.
+            models: The other models of the database, keyed by the names results use.
+
+        """
+
+        self.name = name
+        self.kind = kind
+        self.model = model
+        self.manager = manager
+        self.replica = replica
+        self.fallback = fallback
+        self.models = models or {}
+
+    @property
+    def database(self):
+        """The peewee-async database."""
+        return self.manager.database
+
+    def __repr__(self) -> str:
+        return f"<Backend {self.name}: {self.kind} {self.model.__name__}>"
+
+
+def shard_of(value, shards: int) -> int:
+    """The shard of a key value, stable across processes unlike ``hash()``."""
+    digest = blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shards
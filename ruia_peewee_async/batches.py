@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+from typing import Callable, Dict, Tuple
+
+from peewee import Model
+from peewee_async import Manager
+
+from .buffer import CopyBuffer, InsertBuffer, LoadDataBuffer, UpdateBuffer
+from .dispatch import _backend, _model_name
+from .filters import _remember
+from .spider import Spider
+
+
+def _spool_rows(spider_ins: Spider, record: Callable[[Dict], Tuple]):
+    """The ``on_error`` of a buffer, spooling the record of every row of a failed batch."""
+    spool = getattr(spider_ins, "spool", None)
+    if spool is None:
+        return None
+
+    def spool_rows(rows):
+        for row in rows:
+            spool.append(record(row))
+
+    return spool_rows
+
+
+def _count_dropped(spider_ins: Spider, database: str):
+    """The ``on_drop`` of a buffer, counting the rows that failed in the summary."""
+    reporter = getattr(spider_ins, "reporter", None)
+    if reporter is None:
+        return None
+
+    def count_dropped(rows):
+        for _ in rows:
+            reporter.error(database)
+
+    return count_dropped
+
+
+def _insert_buffer(spider_ins: Spider, database: str, manager: Manager, model: Model):
+    batch_config = getattr(spider_ins, "batch_config", None)
+    if batch_config is None:
+        return None
+    key = (database, model)
+    if key not in spider_ins.insert_buffers:
+        name = _model_name(spider_ins, database, model)
+        spider_ins.insert_buffers[key] = InsertBuffer(
+            manager,
+            model,
+            database.upper(),
+            spider_ins.logger,
+            metrics=spider_ins.metrics,
+            on_error=_spool_rows(
+                spider_ins, lambda row: ("insert", database, row, None, name)
+            ),
+            on_write=partial(_remember, spider_ins, database, model),
+            on_drop=_count_dropped(spider_ins, database),
+            **batch_config,
+        )
+    return spider_ins.insert_buffers[key]
+
+
+# The option and the buffer class of each database's bulk loader.
+BULK_LOADERS = {
+    "mysql": ("load_data", LoadDataBuffer),
+    "postgres": ("copy", CopyBuffer),
+}
+
+
+def _bulk_buffer(spider_ins: Spider, database: str, manager: Manager, model: Model):
+    loader = BULK_LOADERS.get(_backend(spider_ins, database).kind)
+    if loader is None:
+        return None
+    option, buffer_cls = loader
+    bulk_config = getattr(spider_ins, f"{option}_config", None)
+    if bulk_config is None:
+        return None
+    key = (database, model)
+    if key not in spider_ins.bulk_buffers:
+        name = _model_name(spider_ins, database, model)
+        spider_ins.bulk_buffers[key] = buffer_cls(
+            manager,
+            model,
+            database.upper(),
+            spider_ins.logger,
+            metrics=spider_ins.metrics,
+            on_error=_spool_rows(
+                spider_ins, lambda row: ("insert", database, row, None, name)
+            ),
+            on_write=partial(_remember, spider_ins, database, model),
+            on_drop=_count_dropped(spider_ins, database),
+            **bulk_config,
+        )
+    return spider_ins.bulk_buffers[key]
+
+
+def _update_buffer(
+    spider_ins: Spider,
+    database: str,
+    manager: Manager,
+    model: Model,
+    keys: Tuple[str, ...],
+    fields: Tuple[str, ...],
+    create: bool,
+):
+    key = (database, model, keys, fields, create)
+    if key not in spider_ins.update_buffers:
+        name = _model_name(spider_ins, database, model)
+        spider_ins.update_buffers[key] = UpdateBuffer(
+            manager,
+            model,
+            database.upper(),
+            spider_ins.logger,
+            keys,
+            fields,
+            create,
+            metrics=spider_ins.metrics,
+            on_error=_spool_rows(
+                spider_ins,
+                lambda row: (
+                    "update",
+                    database,
+                    row,
+                    {name: row[name] for name in keys},
+                    None,
+                    create,
+                    False,
+                    fields,
+                    name,
+                ),
+            ),
+            # Only the rows created are new keys.
+            on_write=partial(_remember, spider_ins, database, model)
+            if create
+            else None,
+            on_drop=_count_dropped(spider_ins, database),
+            **spider_ins.update_batch_config,
+        )
+    return spider_ins.update_buffers[key]
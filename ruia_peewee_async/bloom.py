@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from hashlib import blake2b
+from math import ceil, log
+from typing import Dict, Iterable, Optional, Sequence
+
+from peewee import Model
+
+
+class BloomFilter:
+    """A bit-array backed Bloom filter of filters values.
+
+    It never answers ``False`` for a key that was added, so a miss means the
+    key is definitely new while a hit still needs to be confirmed by the database.
+    """
+
+    def __init__(
+        self,
+        filters: Sequence[str],
+        capacity: int = 100000,
+        error_rate: float = 0.01,
+        model: Optional[Model] = None,
+    ) -> None:
+        """
+
+        Args:
+            filters: The columns the keys are built from.
+            capacity: The number of keys expected, the error rate grows past it.
+            error_rate: The false positive rate at full capacity.
+            model: The model of the columns, the values are hashed the way they come back from its database.
+
+        """
+
+        self.filters = tuple(filters)
+        self._fields = (
+            None if model is None else [getattr(model, fil) for fil in self.filters]
+        )
+        self.capacity = capacity
+        self.num_bits = max(8, ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * log(2)))
+        self.count = 0
+        self._bits = bytearray(ceil(self.num_bits / 8))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def accepts(self, filters: Sequence[str]) -> bool:
+        return set(filters) == set(self.filters)
+
+    def _values(self, data: Dict) -> Iterable:
+        if self._fields is None:
+            return [data.get(fil) for fil in self.filters]
+        values = []
+        for field in self._fields:
+            value = data.get(field.name)
+            try:
+                value = field.python_value(field.db_value(value))
+            except (TypeError, ValueError):
+                pass
+            values.append(value)
+        return values
+
+    def _positions(self, data: Dict) -> Iterable[int]:
+        raw = "\x1f".join(str(value) for value in self._values(data))
+        digest = blake2b(raw.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, data: Dict) -> None:
+        for pos in self._positions(data):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, data: Dict) -> bool:
+        return all(
+            self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(data)
+        )
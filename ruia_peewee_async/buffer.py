@@ -0,0 +1,536 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import peewee
+from peewee import BlobField, Case, Cast, DataError, Model
+from peewee import OperationalError as PeeweeOperationalError
+from peewee import SqliteDatabase
+from peewee import Tuple as SQLTuple
+from peewee import ValuesList
+from peewee_async import Manager, MySQLDatabase
+from pymysql import OperationalError
+
+from .metrics import Metrics
+
+# The errors of a database that can't be reached, the rows may be written later.
+UNAVAILABLE_ERRORS = (OperationalError, PeeweeOperationalError, OSError)
+
+
+def conflict_target(model: Model, columns: Sequence[str]):
+    """The conflict target of an upsert, MySQL's ON DUPLICATE KEY UPDATE doesn't take one."""
+    meta = model._meta  # pylint: disable=protected-access
+    if isinstance(meta.database, MySQLDatabase):
+        return None
+    return [getattr(model, name) for name in columns]
+
+
+class InsertBuffer:  # pylint: disable=too-many-instance-attributes
+    """Accumulate rows for one (database, model) and insert them with ``insert_many``."""
+
+    action = "insert"
+
+    def __init__(
+        self,
+        manager: Manager,
+        model: Model,
+        name: str,
+        logger,
+        size: int = 100,
+        max_latency: float = 1.0,
+        metrics: Metrics = None,
+        on_error: Callable[[List[Dict]], None] = None,
+        on_write: Callable[[Dict, Optional[Sequence[str]]], None] = None,
+        on_drop: Callable[[List[Dict]], None] = None,
+    ) -> None:
+        """
+
+        Args:
+            manager: The peewee-async manager of the target database.
+            model: The peewee model rows are inserted into.
+            name: The target database name, used in log messages and metrics.
+            logger: The spider's logger.
+            size: Flush when this many rows are pending.
+            max_latency: Flush when the oldest pending row is older than this many seconds.
+            metrics: Where the flushes are recorded as ``batch_<action>`` operations.
+            on_error: Called with the rows of a batch whose database was unavailable, instead of dropping them.
+            on_write: Called with every row written and the filters it was added with.
+            on_drop: Called with the rows that failed and weren't given to on_error.
+
+        """
+
+        self.manager = manager
+        self.model = model
+        self.name = name
+        self.logger = logger
+        self.size = size
+        self.max_latency = max_latency
+        self.metrics = metrics
+        self.on_error = on_error
+        self.on_write = on_write
+        self.on_drop = on_drop
+        self.rows: List[Dict] = []
+        # The rows taken by the flush going on, until their write returns.
+        self.flushing: List[Dict] = []
+        self._filters: Dict[int, Sequence[str]] = {}
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def is_pending(self, data: Dict, filters: Sequence[str]) -> bool:
+        """Whether a row with the same filters values is waiting to be written."""
+        key = [data.get(fil) for fil in filters]
+        return any(
+            [row.get(fil) for fil in filters] == key
+            for rows in (self.rows, self.flushing)
+            for row in rows
+        )
+
+    async def add(self, data: Dict, filters: Optional[Sequence[str]] = None) -> int:
+        self.rows.append(data)
+        if filters:
+            self._filters[id(data)] = filters
+        if len(self.rows) >= self.size:
+            return await self.flush()
+        if self._timer is None:
+            self._timer = asyncio.ensure_future(self._flush_later())
+        return 0
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_latency)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.error(
+                f"<RuiaPeeweeAsync: {self.name} batch {self.action} error: {exc}>"
+            )
+
+    def _take(self) -> List[Dict]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def _restore(self, rows: List[Dict]) -> None:
+        """Put back the rows of a cancelled flush, before the rows added since."""
+        self.rows[:0] = rows
+
+    async def _write(self, rows: List[Dict]) -> int:
+        await self.manager.execute(self.model.insert_many(rows))
+        return len(rows)
+
+    async def _write_row(self, row: Dict) -> int:
+        # A bulk loader's rows are retried with a plain INSERT.
+        return await InsertBuffer._write(self, [row])
+
+    async def close(self) -> None:
+        """Release what the buffer holds besides its rows, after the last flush."""
+
+    async def _timed_write(self, rows: List[Dict]) -> int:
+        if self.metrics is None:
+            return await self._write(rows)
+        with self.metrics.timer(self.name.lower(), f"batch_{self.action}", len(rows)):
+            return await self._write(rows)
+
+    async def flush(self) -> int:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            rows = self.flushing = self._take()
+            if not rows:
+                return 0
+            # insert_many takes its columns from the first row, so rows with
+            # different keys have to go in separate statements.
+            groups: Dict[Tuple[str, ...], List[Dict]] = {}
+            for row in rows:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            written = 0
+            pending = list(groups.values())
+            try:
+                while pending:
+                    written += await self._write_group(pending[0])
+                    pending.pop(0)
+            except asyncio.CancelledError:
+                self._restore([row for grp in pending for row in grp])
+                raise
+            finally:
+                self.flushing = []
+            failed = len(rows) - written
+            if failed:
+                self.logger.error(
+                    f"<RuiaPeeweeAsync: batch {self.action} {written} rows into {self.name}, "
+                    f"{failed} rows failed>"
+                )
+            else:
+                self.logger.info(
+                    f"<RuiaPeeweeAsync: Success batch {self.action} {written} rows into {self.name}>"
+                )
+            return written
+
+    async def _write_group(self, group: List[Dict]) -> int:
+        """Write a group of rows, one by one if the batch fails on the rows' data."""
+        try:
+            affected = await self._timed_write(group)
+        except UNAVAILABLE_ERRORS as ope:  # pragma: no cover
+            self._failed(group, ope)
+            return 0
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.error(
+                f"<RuiaPeeweeAsync: {self.name} batch {self.action} of {len(group)} "
+                f"rows error: {exc}, writing them one by one>"
+            )
+            return await self._write_rows(group)
+        if affected != len(group):
+            self.logger.info(
+                f"<RuiaPeeweeAsync: batch {self.action} of {len(group)} "
+                f"rows affected {affected} rows in {self.name}>"
+            )
+        self._written(group)
+        return len(group)
+
+    async def _write_rows(self, rows: List[Dict]) -> int:
+        written = 0
+        for position, row in enumerate(rows):
+            try:
+                await self._write_row(row)
+            except UNAVAILABLE_ERRORS as ope:  # pragma: no cover
+                self._failed(rows[position:], ope)
+                break
+            except Exception as exc:  # pylint: disable=broad-except
+                # The row itself is at fault, so it would fail again.
+                self._filters.pop(id(row), None)
+                self.logger.error(
+                    f"<RuiaPeeweeAsync: {self.name} {self.action} data: {row} "
+                    f"error: {exc}, dropped>"
+                )
+                self._dropped([row])
+            else:
+                self._written([row])
+                written += 1
+        return written
+
+    def _failed(self, rows: List[Dict], exc: Exception) -> None:
+        self.logger.error(
+            f"<RuiaPeeweeAsync: {self.name} batch {self.action} "
+            f"{len(rows)} rows error: {exc}>"
+        )
+        for row in rows:
+            self._filters.pop(id(row), None)
+        if self.on_error is not None:
+            self.on_error(rows)
+        else:
+            self._dropped(rows)
+
+    def _dropped(self, rows: List[Dict]) -> None:
+        if self.on_drop is not None:
+            self.on_drop(rows)
+
+    def _written(self, rows: List[Dict]) -> None:
+        for row in rows:
+            filters = self._filters.pop(id(row), None)
+            if self.on_write is not None:
+                self.on_write(row, filters)
+
+
+class CopyBuffer(InsertBuffer):
+    """Load the buffered rows into PostgreSQL with ``COPY ... FROM STDIN``.
+
+    aiopg can't run COPY, so the rows go through a psycopg2 connection of the
+    buffer's own in a worker thread, it's closed by ``close``.
+    """
+
+    action = "copy"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._connection = None
+
+    async def _write(self, rows: List[Dict]) -> int:
+        meta = self.model._meta  # pylint: disable=protected-access
+        fields = [meta.fields[name] for name in rows[0]]
+        stream = StringIO()
+        for row in rows:
+            values = (field.db_value(row[field.name]) for field in fields)
+            # bytea reads its hex format, a backslash isn't an escape in CSV.
+            stream.write(",".join(_csv_value(value, "", "\\x") for value in values))
+            stream.write("\n")
+        stream.seek(0)
+        columns = ", ".join(_quote(field.column_name) for field in fields)
+        sql = f"COPY {_quote(meta.table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+        await asyncio.get_event_loop().run_in_executor(None, self._copy, sql, stream)
+        return len(rows)
+
+    def _copy(self, sql: str, stream: StringIO):
+        with peewee.__exception_wrapper__:
+            if self._connection is None or self._connection.closed:
+                # psycopg2 is only needed by the PostgreSQL databases.
+                import psycopg2  # pylint: disable=import-outside-toplevel
+
+                database = self.manager.database
+                self._connection = psycopg2.connect(
+                    database=database.database, **database.connect_params
+                )
+            # Committed, or rolled back if COPY fails.
+            with self._connection, self._connection.cursor() as cursor:
+                cursor.copy_expert(sql, stream)
+
+    async def close(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            await asyncio.get_event_loop().run_in_executor(None, connection.close)
+
+
+class LoadDataBuffer(InsertBuffer):
+    """Load the buffered rows into MySQL with ``LOAD DATA LOCAL INFILE``.
+
+    The rows are written to a temporary CSV file that aiomysql streams to the server,
+    the server needs ``local_infile`` enabled.
+    """
+
+    action = "load"
+
+    async def _write(self, rows: List[Dict]) -> int:
+        meta = self.model._meta  # pylint: disable=protected-access
+        fields = [meta.fields[name] for name in rows[0]]
+        lines = []
+        for row in rows:
+            values = (field.db_value(row[field.name]) for field in fields)
+            # Without an escape character, MySQL reads an unquoted NULL as NULL.
+            lines.append(",".join(_csv_value(value, "NULL") for value in values))
+        loop = asyncio.get_event_loop()
+        path = await loop.run_in_executor(None, _write_file, "\n".join(lines) + "\n")
+        columns, blobs = [], []
+        for position, field in enumerate(fields):
+            if isinstance(field, BlobField):
+                # The blobs are written in hex and decoded by the server.
+                columns.append(f"@blob{position}")
+                blobs.append(f"`{field.column_name}` = UNHEX(@blob{position})")
+            else:
+                columns.append(f"`{field.column_name}`")
+        sql = (
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{meta.table_name}` "
+            "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            f"LINES TERMINATED BY '\\n' ({', '.join(columns)})"
+        )
+        if blobs:
+            sql += f" SET {', '.join(blobs)}"
+        try:
+            return await self._load(sql, path, len(rows))
+        finally:
+            os.unlink(path)
+
+    async def _load(self, sql: str, path: str, expected: int) -> int:
+        """Run LOAD DATA in a transaction, rolled back unless every row loaded cleanly.
+
+        LOAD DATA LOCAL skips duplicate keys and stores the values it can't convert
+        with a warning only, so such a batch raises and its rows are inserted one by one.
+        """
+        with peewee.__exception_wrapper__:
+            cursor = await self.manager.database.cursor_async()
+            try:
+                await cursor.execute("BEGIN")
+                try:
+                    await cursor.execute(sql, (path,))
+                    loaded = cursor.rowcount
+                    await cursor.execute("SHOW WARNINGS LIMIT 3")
+                    warnings = [warning[2] for warning in await cursor.fetchall()]
+                except BaseException:
+                    await cursor.execute("ROLLBACK")
+                    raise
+                if loaded == expected and not warnings:
+                    await cursor.execute("COMMIT")
+                    return loaded
+                await cursor.execute("ROLLBACK")
+            finally:
+                await cursor.release()
+        raise DataError(f"loaded {loaded} of {expected} rows, warnings: {warnings}")
+
+
+def _write_file(content: str) -> str:
+    with NamedTemporaryFile(
+        "w", encoding="utf-8", suffix=".csv", delete=False
+    ) as stream:
+        stream.write(content)
+    return stream.name
+
+
+def _quote(name: str) -> str:
+    escaped = name.replace('"', '""')
+    return f'"{escaped}"'
+
+
+def _csv_value(value, null: str = "", hex_prefix: str = "") -> str:
+    # Non-null values are always quoted, so they never read as the unquoted null marker.
+    if value is None:
+        return null
+    if isinstance(value, bool):
+        return _quote(str(int(value)))
+    # psycopg2 wraps the bytes of a blob in its Binary adapter.
+    value = getattr(value, "adapted", value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _quote(hex_prefix + bytes(value).hex())
+    return _quote(str(value))
+
+
+class UpdateBuffer(InsertBuffer):
+    """Accumulate updates sharing the same query columns and updated columns.
+
+    Pending updates of the same row are merged, and each flush updates the rows in one
+    statement: ``UPDATE ... FROM (VALUES ...)`` on PostgreSQL and a ``CASE`` based
+    ``UPDATE`` on MySQL and SQLite. When missing rows should be created, the existing
+    keys are selected first and only the rows of the other keys are inserted.
+    """
+
+    action = "update"
+
+    def __init__(
+        self,
+        manager: Manager,
+        model: Model,
+        name: str,
+        logger,
+        keys: Sequence[str],
+        fields: Sequence[str],
+        create: bool = False,
+        size: int = 100,
+        max_latency: float = 1.0,
+        metrics: Metrics = None,
+        on_error: Callable[[List[Dict]], None] = None,
+        on_write: Callable[[Dict, Optional[Sequence[str]]], None] = None,
+        on_drop: Callable[[List[Dict]], None] = None,
+    ) -> None:
+        """
+
+        Args:
+            keys: The query columns identifying a row.
+            fields: The columns to update.
+            create: Create the rows that don't exist yet.
+
+        """
+
+        super().__init__(
+            manager,
+            model,
+            name,
+            logger,
+            size,
+            max_latency,
+            metrics,
+            on_error,
+            on_write,
+            on_drop,
+        )
+        self.keys = tuple(keys)
+        self.fields = tuple(fields)
+        self.create = create
+        self._positions: Dict[Tuple, int] = {}
+
+    async def add(self, data: Dict, filters: Optional[Sequence[str]] = None) -> int:
+        if self._merge(data):
+            return 0
+        return await super().add(data, filters)
+
+    def _merge(self, data: Dict) -> bool:
+        """Merge the update into the pending one of the same row, False if there's none."""
+        key = tuple(data[name] for name in self.keys)
+        position = self._positions.get(key)
+        if position is not None:
+            self.rows[position].update(data)
+            return True
+        self._positions[key] = len(self.rows)
+        return False
+
+    def _take(self) -> List[Dict]:
+        self._positions = {}
+        return super()._take()
+
+    def _restore(self, rows: List[Dict]) -> None:
+        # The positions are rebuilt, and the updates added since are merged into them.
+        for row in rows + self._take():
+            if not self._merge(row):
+                self.rows.append(row)
+
+    async def _write_row(self, row: Dict) -> int:
+        return await self._write([row])
+
+    async def _write(self, rows: List[Dict]) -> int:
+        if not self.create:
+            return await self._update(rows)
+        existing = await self._existing(rows)
+        found = [row for row in rows if self._key(row) in existing]
+        missing = [row for row in rows if self._key(row) not in existing]
+        written = await self._update(found) if found else 0
+        if missing:
+            # A missing row is created from the whole item, like the unbatched update does.
+            await self.manager.execute(self.model.insert_many(missing))
+            written += len(missing)
+        return written
+
+    def _key(self, row: Dict) -> Tuple:
+        """The key of a row the way the database returns it."""
+        fields = [getattr(self.model, name) for name in self.keys]
+        return tuple(
+            field.python_value(field.db_value(row[field.name])) for field in fields
+        )
+
+    async def _existing(self, rows: List[Dict]) -> Set[Tuple]:
+        key_fields = [getattr(self.model, name) for name in self.keys]
+        keys = [SQLTuple(*[row[name] for name in self.keys]) for row in rows]
+        query = (
+            self.model.select(*key_fields)
+            .where(SQLTuple(*key_fields).in_(keys))
+            .tuples()
+        )
+        return set(await self.manager.execute(query))
+
+    async def _update(self, rows: List[Dict]) -> int:
+        model = self.model
+        key_fields = [getattr(model, name) for name in self.keys]
+        meta = model._meta  # pylint: disable=protected-access
+        if isinstance(meta.database, (MySQLDatabase, SqliteDatabase)):
+            target = SQLTuple(*key_fields)
+            keys = [SQLTuple(*[row[name] for name in self.keys]) for row in rows]
+            query = model.update(
+                {
+                    getattr(model, name): Case(
+                        None,
+                        [(target == key, row[name]) for key, row in zip(keys, rows)],
+                        getattr(model, name),
+                    )
+                    for name in self.fields
+                }
+            ).where(target.in_(keys))
+        else:
+            columns = self.keys + self.fields
+            values = ValuesList(
+                [[row[name] for name in columns] for row in rows],
+                columns=columns,
+                alias="batch",
+            )
+
+            def column(name):
+                field = getattr(model, name)
+                return Cast(getattr(values.c, name), _column_type(model, field))
+
+            query = (
+                model.update(
+                    {getattr(model, name): column(name) for name in self.fields}
+                )
+                .from_(values)
+                .where(*[field == column(field.name) for field in key_fields])
+            )
+        return await self.manager.execute(query)
+
+
+def _column_type(model: Model, field) -> str:
+    field_type = {"AUTO": "INT", "BIGAUTO": "BIGINT"}.get(
+        field.field_type, field.field_type
+    )
+    database = model._meta.database  # pylint: disable=protected-access
+    field_types = database._field_types  # pylint: disable=protected-access
+    return field_types.get(field_type, field_type)
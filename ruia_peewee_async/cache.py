@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Sequence, Tuple
+from typing import Optional as TOptional
+
+
+class FilterCache:
+    """A bounded LRU cache of filters values known to exist in one table."""
+
+    def __init__(self, size: int = 10000, ttl: TOptional[float] = None) -> None:
+        """
+
+        Args:
+            size: The maximum number of keys kept, the least recently used ones are evicted first.
+            ttl: Seconds a key stays valid, keys never expire if it's None.
+
+        """
+
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._keys: "OrderedDict[Tuple, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @staticmethod
+    def key(data: Dict, filters: Sequence[str]) -> Tuple:
+        return tuple(filters), tuple(data.get(fil) for fil in filters)
+
+    def seen(self, data: Dict, filters: Sequence[str]) -> bool:
+        key = self.key(data, filters)
+        added = self._keys.get(key)
+        if added is None or (self.ttl is not None and monotonic() - added > self.ttl):
+            self._keys.pop(key, None)
+            self.misses += 1
+            return False
+        self._keys.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, data: Dict, filters: Sequence[str]) -> None:
+        key = self.key(data, filters)
+        self._keys[key] = monotonic()
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
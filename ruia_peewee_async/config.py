@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+import signal
+from ssl import SSLContext
+from typing import Dict, Sequence
+
+from schema import And, Optional, Or, Schema, SchemaError
+
+
+def database_schema() -> Dict:
+    """The schema of a mysql or postgres config."""
+    return {
+        "host": And(str),
+        "user": And(str),
+        "password": And(str),
+        "database": And(str),
+        "model": And({"table_name": And(str), str: object}),
+        Optional("models"): {
+            And(str, str.isidentifier): {"table_name": And(str), str: object}
+        },
+        Optional("port"): And(int),
+        Optional("ssl"): And(SSLContext),
+        Optional("pool"): And(bool),
+        Optional("min_connections"): And(int, lambda mic: mic >= 1),
+        Optional("max_connections"): And(int, lambda mac: mac >= 1),
+        Optional("replica"): {
+            Optional("host"): And(str),
+            Optional("port"): And(int),
+            Optional("user"): And(str),
+            Optional("password"): And(str),
+            Optional("database"): And(str),
+            Optional("ssl"): And(SSLContext),
+            Optional("pool"): And(bool),
+            Optional("min_connections"): And(int, lambda mic: mic >= 1),
+            Optional("max_connections"): And(int, lambda mac: mac >= 1),
+            Optional("fallback"): And(bool),
+        },
+    }
+
+
+def sqlite_schema() -> Dict:
+    """The schema of a sqlite config."""
+    return {
+        "database": And(str, len),
+        "model": And({"table_name": And(str), str: object}),
+        Optional("models"): {
+            And(str, str.isidentifier): {"table_name": And(str), str: object}
+        },
+        Optional("pragmas"): {str: object},
+        Optional("commit_size"): And(int, lambda size: size > 0),
+        Optional("commit_interval"): And(Or(int, float), lambda interval: interval > 0),
+    }
+
+
+def _connections_ordered(config: Dict) -> bool:
+    """Whether a config's pool, and its replica's, has no more minimum than maximum connections."""
+    for conf in (config, {**config, **config.get("replica", {})}):
+        if conf.get("min_connections", 1) > conf.get("max_connections", float("inf")):
+            return False
+    return True
+
+
+def check_config(kwargs) -> Sequence[Dict]:
+    # no_config_msg = """
+    #         RuiaPeeweeAsync must have a param named mysql_config or postgres_config or both, eg:
+    #         mysql_config = {
+    #             'user': 'yourusername',
+    #             'password': 'yourpassword',
+    #             'host': '127.0.0.1',
+    #             'port': 3306,
+    #             'database': 'ruia_mysql',
+    #             'model': {{
+    #                 'table_name': 'ruia_mysql_table',
+    #                 "title": CharField(),
+    #                 'url': CharField(),
+    #             }},
+    #         }
+    #         postgres_config = {
+    #             'user': 'yourusername',
+    #             'password': 'yourpassword',
+    #             'host': '127.0.0.1',
+    #             'port': 5432,
+    #             'database': 'ruia_postgres',
+    #             'model': {{
+    #                 'table_name': 'ruia_postgres_table',
+    #                 "title": CharField(),
+    #                 'url': CharField(),
+    #             }},
+    #         }
+    #         """
+    conf_validator = Schema(
+        {
+            Or("mysql", "postgres"): Or(
+                None, And(database_schema(), _connections_ordered)
+            )
+        }
+    )
+    kwval = conf_validator.validate(kwargs)
+    mysql = kwval.get("mysql", {})
+    postgres = kwval.get("postgres", {})
+    mysql_model = mysql.get("model", None)
+    postgres_model = postgres.get("model", None)
+    return mysql, mysql_model, postgres, postgres_model
+
+
+OPTIONS = (
+    "batch",
+    "copy",
+    "load_data",
+    "update_batch",
+    "filter_cache",
+    "bloom",
+    "filter_batch",
+    "upsert",
+    "write_queue",
+    "metrics",
+    "summary",
+    "validation",
+    "backends",
+    "sharding",
+    "adaptive_pool",
+    "spool",
+    "retry",
+    "circuit_breaker",
+    "sql_templates",
+    "profile",
+)
+
+
+def check_options(kwargs) -> Dict:
+    batch = {
+        Optional("size"): And(int, lambda size: size > 0),
+        Optional("max_latency"): And(Or(int, float), lambda latency: latency > 0),
+    }
+    option_validator = Schema(
+        {
+            Optional("batch"): Or(None, batch),
+            Optional("copy"): Or(None, batch),
+            Optional("load_data"): Or(None, batch),
+            Optional("update_batch"): Or(None, batch),
+            Optional("filter_cache"): Or(
+                None,
+                {
+                    Optional("size"): And(int, lambda size: size > 0),
+                    Optional("ttl"): Or(None, And(Or(int, float), lambda ttl: ttl > 0)),
+                },
+            ),
+            Optional("bloom"): Or(
+                None,
+                {
+                    "filters": Or(And(str, len), And([str], len)),
+                    Optional("capacity"): And(int, lambda capacity: capacity > 0),
+                    Optional("error_rate"): And(float, lambda rate: 0 < rate < 1),
+                    Optional("chunk_size"): And(int, lambda size: size > 0),
+                },
+            ),
+            Optional("upsert"): bool,
+            Optional("filter_batch"): Or(
+                None,
+                {
+                    Optional("window"): And(Or(int, float), lambda window: window >= 0),
+                    Optional("size"): And(int, lambda size: size > 0),
+                },
+            ),
+            Optional("write_queue"): Or(
+                None,
+                {
+                    Optional("size"): And(int, lambda size: size > 0),
+                    Optional("workers"): And(int, lambda workers: workers > 0),
+                },
+            ),
+            Optional("metrics"): Or(
+                None,
+                {
+                    Optional("path"): And(str),
+                    Optional("host"): And(str),
+                    Optional("port"): And(int, lambda port: 0 <= port <= 65535),
+                    Optional("buckets"): And(
+                        [Or(int, float)], lambda buckets: len(buckets) > 0
+                    ),
+                },
+            ),
+            Optional("backends"): Or(
+                None,
+                {
+                    And(
+                        str,
+                        lambda name: name.isidentifier()
+                        and name.lower() not in ("mysql", "postgres", "sqlite", "both"),
+                    ): Or(
+                        And(
+                            {"type": Or("mysql", "postgres"), **database_schema()},
+                            _connections_ordered,
+                        ),
+                        {"type": "sqlite", **sqlite_schema()},
+                    )
+                },
+            ),
+            Optional("spool"): Or(
+                None,
+                {
+                    "path": And(str, len),
+                    Optional("fsync"): Or("always", "batch", "never"),
+                    Optional("fsync_interval"): And(
+                        Or(int, float), lambda interval: interval > 0
+                    ),
+                    Optional("overflow"): bool,
+                    Optional("replay_interval"): And(
+                        Or(int, float), lambda interval: interval > 0
+                    ),
+                    Optional("batch"): And(int, lambda batch: batch > 0),
+                },
+            ),
+            Optional("retry"): Or(
+                None,
+                {
+                    Optional("attempts"): And(int, lambda attempts: attempts > 0),
+                    Optional("base"): And(Or(int, float), lambda base: base >= 0),
+                    Optional("cap"): And(Or(int, float), lambda cap: cap >= 0),
+                },
+            ),
+            Optional("circuit_breaker"): Or(
+                None,
+                {
+                    Optional("threshold"): And(int, lambda threshold: threshold > 0),
+                    Optional("reset"): And(Or(int, float), lambda reset: reset > 0),
+                },
+            ),
+            Optional("sql_templates"): Or(
+                None,
+                {Optional("size"): And(int, lambda size: size > 0)},
+            ),
+            Optional("profile"): Or(
+                None,
+                {
+                    Optional("timer"): bool,
+                    Optional("hooks"): [callable],
+                    Optional("mode"): Or("cprofile", "sampling"),
+                    Optional("items"): And(int, lambda items: items > 0),
+                    Optional("start"): bool,
+                    Optional("signal"): And(
+                        str, lambda name: isinstance(getattr(signal, name, None), int)
+                    ),
+                    Optional("path"): And(str, len),
+                    Optional("interval"): And(
+                        Or(int, float), lambda interval: interval > 0
+                    ),
+                    Optional("top"): And(int, lambda top: top > 0),
+                },
+            ),
+            Optional("adaptive_pool"): Or(
+                None,
+                {
+                    Optional("interval"): And(
+                        Or(int, float), lambda interval: interval > 0
+                    ),
+                    Optional("wait"): And(Or(int, float), lambda wait: wait > 0),
+                },
+            ),
+            Optional("sharding"): Or(
+                None,
+                {
+                    "key": And(str, len),
+                    "backends": And([str], lambda backends: len(backends) > 1),
+                },
+                {
+                    "key": And(str, len),
+                    "tables": And(int, lambda tables: tables > 1),
+                },
+            ),
+            Optional("validation"): Or(
+                None,
+                {
+                    Optional("mode"): Or("full", "sampled", "off"),
+                    Optional("first"): And(int, lambda first: first >= 0),
+                    Optional("every"): And(int, lambda every: every > 0),
+                },
+            ),
+            Optional("summary"): Or(
+                None,
+                {
+                    Optional("interval"): And(
+                        Or(int, float), lambda interval: interval > 0
+                    ),
+                },
+            ),
+        }
+    )
+    options = option_validator.validate(kwargs)
+    if "tables" in (options.get("sharding") or {}):
+        # Sharded tables register a <kind>_<n> backend per table.
+        for name in options.get("backends") or {}:
+            kind, _, shard = name.lower().rpartition("_")
+            if kind in ("mysql", "postgres", "sqlite") and shard.isdigit():
+                raise SchemaError(
+                    f"Key 'backends' error:\n{name} is the name of a sharded table"
+                )
+    return options
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from typing import Dict, Tuple
+
+from peewee import Model
+from peewee_async import (
+    Manager,
+    MySQLDatabase,
+    PooledMySQLDatabase,
+    PooledPostgresqlDatabase,
+    PostgresqlDatabase,
+)
+
+from .sqlite import SqliteManager, sqlite_database
+
+
+DATABASE_CLASSES = {
+    "mysql": (MySQLDatabase, PooledMySQLDatabase),
+    "postgres": (PostgresqlDatabase, PooledPostgresqlDatabase),
+}
+
+
+def _database(kind: str, config: Dict):
+    if kind == "sqlite":
+        return sqlite_database(config["database"], config.get("pragmas"))
+    database_cls, pooled_cls = DATABASE_CLASSES[kind]
+    params = {
+        key: val
+        for key, val in config.items()
+        if key not in ("model", "models", "replica")
+    }
+    if "pool" in params:
+        del params["pool"]
+        return pooled_cls(**params)
+    return database_cls(**params)
+
+
+def _replica(kind: str, config: Dict) -> Tuple:
+    """The manager and the fallback of the read replica of a config, if it has one.
+
+    The replica's connection defaults to the primary's for the keys it doesn't set.
+    """
+    replica = config.get("replica")
+    if not replica:
+        return None, True
+    params = {key: val for key, val in replica.items() if key != "fallback"}
+    return Manager(_database(kind, {**config, **params})), replica.get("fallback", True)
+
+
+def _connect(kind: str, config: Dict, create_table: bool = False) -> Tuple:
+    """Build the database, model and manager of a mysql, postgres or sqlite config."""
+    mconf = config.get("model", {})
+    database = _database(kind, config)
+    if kind == "sqlite":
+        manager = SqliteManager(
+            database,
+            config.get("commit_size", 1000),
+            config.get("commit_interval", 1.0),
+        )
+    else:
+        manager = Manager(database)
+    model = _model(database, mconf)
+    if create_table:
+        with manager.allow_sync():
+            model.create_table(True)
+    return database, model, manager
+
+
+def _model(database, mconf: Dict) -> Model:
+    fields = {key: val for key, val in mconf.items() if key != "table_name"}
+    fields["Meta"] = type("Meta", (object,), {"database": database})
+    return type(mconf["table_name"], (Model,), fields)
+
+
+def _models(manager, config: Dict, create_table: bool = False) -> Dict[str, Model]:
+    """The models of a config's ``models``, keyed by their names."""
+    models = {
+        name: _model(manager.database, mconf)
+        for name, mconf in config.get("models", {}).items()
+    }
+    if create_table:
+        with manager.allow_sync():
+            for model in models.values():
+                model.create_table(True)
+    return models
+
+
+def create_model(spider_ins=None, create_table=False, **kwargs) -> Tuple:
+    mysql, postgres = kwargs.get("mysql", {}), kwargs.get("postgres", {})
+    mysql_model, mysql_manager, postgres_model, postgres_manager = (
+        None,
+        None,
+        None,
+        None,
+    )
+    if mysql:
+        mysql_db, mysql_model, mysql_manager = _connect("mysql", mysql, create_table)
+        if spider_ins:
+            spider_ins.mysql_db = mysql_db
+            spider_ins.mysql_model = mysql_model
+            spider_ins.mysql_manager = mysql_manager
+    if postgres:
+        postgres_db, postgres_model, postgres_manager = _connect(
+            "postgres", postgres, create_table
+        )
+        if spider_ins:
+            spider_ins.postgres_db = postgres_db
+            spider_ins.postgres_model = postgres_model
+            spider_ins.postgres_manager = postgres_manager
+    sqlite = kwargs.get("sqlite", {})
+    if sqlite:
+        sqlite_db, sqlite_model, sqlite_manager = _connect(
+            "sqlite", sqlite, create_table
+        )
+        if spider_ins:
+            spider_ins.sqlite_db = sqlite_db
+            spider_ins.sqlite_model = sqlite_model
+            spider_ins.sqlite_manager = sqlite_manager
+        if not mysql and not postgres:
+            return sqlite_model, sqlite_manager
+    if mysql and not postgres:
+        return mysql_model, mysql_manager
+    if postgres and not mysql:
+        return postgres_model, postgres_manager
+    return mysql_model, mysql_manager, postgres_model, postgres_manager
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Awaitable, Callable, Dict
+from typing import Optional as TOptional
+
+from peewee import Model
+from peewee import OperationalError as PeeweeOperationalError
+from pymysql import OperationalError
+from schema import SchemaError
+
+from .backend import Backend
+from .profile import NO_STAGE
+from .retry import is_transient
+from .spider import Spider
+
+try:
+    from psycopg2 import OperationalError as PostgresOperationalError
+except ImportError:  # pragma: no cover
+    POSTGRES_ERRORS = ()
+else:
+    POSTGRES_ERRORS = (PostgresOperationalError,)
+
+
+def _backend(spider_ins: Spider, database: str) -> Backend:
+    try:
+        return spider_ins.backends[database]
+    except KeyError:
+        raise SchemaError(
+            f"<RuiaPeeweeAsync: no backend named {database}, "
+            f"configured: {list(spider_ins.backends)}>"
+        ) from None
+
+
+def _backend_model(backend: Backend, name: TOptional[str]) -> Model:
+    if name is None:
+        return backend.model
+    try:
+        return backend.models[name]
+    except (KeyError, TypeError):
+        raise SchemaError(
+            f"<RuiaPeeweeAsync: {backend.name.upper()} has no model named {name}, "
+            f"configured: {list(backend.models)}>"
+        ) from None
+
+
+def _model_name(spider_ins: Spider, database: str, model: Model) -> TOptional[str]:
+    """The name a result gives to write to the model, the inverse of _backend_model."""
+    backend = _backend(spider_ins, database)
+    for name, named in backend.models.items():
+        if named is model:
+            return name
+    return None
+
+
+# The errors of a database that can't be reached or is shutting down,
+# peewee-async raises the drivers' errors wrapped in peewee's.
+CONNECTION_ERRORS = (
+    OperationalError,
+    PeeweeOperationalError,
+    *POSTGRES_ERRORS,
+    OSError,
+)
+
+
+async def _read(spider_ins: Spider, backend: Backend, func: Callable[..., Awaitable]):
+    """Run ``func(manager)`` on the replica of the backend, or on its primary without one.
+
+    When the replica fails and the backend falls back, the read is retried on the primary.
+    """
+    if backend.replica is None:
+        return await func(backend.manager)
+    try:
+        return await func(backend.replica)
+    except CONNECTION_ERRORS as exc:
+        if not backend.fallback:
+            raise
+        spider_ins.logger.warning(
+            f"<RuiaPeeweeAsync: {backend.name.upper()} replica read error: {exc}, "
+            "reading from the primary>"
+        )
+    return await func(backend.manager)
+
+
+async def _call(
+    spider_ins: Spider,
+    database: str,
+    func: Callable[[], Awaitable],
+    breaker: bool = True,
+):
+    """Await ``func()``, retried under the retry policy and guarded by the database's breaker.
+
+    Only the transient connection errors are retried, anything else means the database answered.
+    """
+    policy = getattr(spider_ins, "retry_policy", None)
+    circuit = getattr(spider_ins, "breakers", {}).get(database) if breaker else None
+    attempt = 0
+    while True:
+        if circuit is not None:
+            circuit.check()
+        try:
+            result = await func()
+        except CONNECTION_ERRORS as exc:
+            if not is_transient(exc):
+                if circuit is not None:
+                    circuit.success()
+                raise
+            if circuit is not None:
+                circuit.failure()
+            attempt += 1
+            if policy is None or attempt >= policy.attempts:
+                raise
+            policy.retries += 1
+            delay = policy.backoff(attempt - 1)
+            spider_ins.logger.warning(
+                f"<RuiaPeeweeAsync: {database.upper()} error: {exc}, "
+                f"retry {attempt} in {delay:.3f}s>"
+            )
+            await asyncio.sleep(delay)
+        except Exception:
+            if circuit is not None:
+                circuit.success()
+            raise
+        else:
+            if circuit is not None:
+                circuit.success()
+            return result
+
+
+def _create(spider_ins: Spider, manager, model: Model, data: Dict):
+    templates = getattr(spider_ins, "sql_templates", None)
+    if templates is None:
+        return manager.create(model, **data)
+    return templates.create(manager, model, data)
+
+
+def _save(spider_ins: Spider, manager, obj: Model, only=None):
+    templates = getattr(spider_ins, "sql_templates", None)
+    if templates is None:
+        return manager.update(obj, only=only)
+    return templates.update(manager, obj, only)
+
+
+def _stage(spider_ins: Spider, name: str, database: TOptional[str] = None):
+    profiler = getattr(spider_ins, "profiler", None)
+    if profiler is None:
+        return NO_STAGE
+    return profiler.stage(name, database)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from peewee import DoesNotExist, Model
+from peewee_async import Manager
+
+from .cache import FilterCache
+from .dispatch import _backend, _call, _read
+from .lookup import FilterLookup
+from .spider import Spider
+
+
+async def filter_func(data, manager, model, filters) -> bool:
+    conditions = [getattr(model, fil) for fil in filters]
+    query = {x.name: data[x.name] for x in conditions}
+    try:
+        await manager.get(model, **query)
+    except DoesNotExist:
+        return False
+    return True
+
+
+def _filter_cache(spider_ins: Spider, database: str, model: Model):
+    filter_cache_config = getattr(spider_ins, "filter_cache_config", None)
+    if filter_cache_config is None:
+        return None
+    key = (database, model)
+    if key not in spider_ins.filter_caches:
+        spider_ins.filter_caches[key] = FilterCache(**filter_cache_config)
+    return spider_ins.filter_caches[key]
+
+
+def _filter_lookup(
+    spider_ins: Spider, database: str, manager: Manager, model: Model, filters
+):
+    filter_batch_config = getattr(spider_ins, "filter_batch_config", None)
+    if filter_batch_config is None:
+        return None
+    key = (database, model, tuple(filters))
+    if key not in spider_ins.filter_lookups:
+        backend = _backend(spider_ins, database)
+        spider_ins.filter_lookups[key] = FilterLookup(
+            manager,
+            model,
+            filters,
+            execute=lambda query: _read(
+                spider_ins, backend, lambda reader: reader.execute(query)
+            ),
+            **filter_batch_config,
+        )
+    return spider_ins.filter_lookups[key]
+
+
+async def _is_filtered(
+    spider_ins: Spider, database: str, manager: Manager, model: Model, data, filters
+) -> bool:
+    cache = _filter_cache(spider_ins, database, model)
+    if cache is not None and cache.seen(data, filters):
+        return True
+    for buffers in (spider_ins.insert_buffers, spider_ins.bulk_buffers):
+        buffer = buffers.get((database, model))
+        if buffer is not None and buffer.is_pending(data, filters):
+            return True
+    bloom = spider_ins.bloom_filters.get((database, model))
+    if bloom is not None and bloom.accepts(filters) and data not in bloom:
+        return False
+    lookup = None
+    # A NULL is matched with IS NULL by filter_func alone.
+    if all(data.get(fil) is not None for fil in filters):
+        lookup = _filter_lookup(spider_ins, database, manager, model, filters)
+    with spider_ins.metrics.timer(database, "filter"):
+        if lookup is not None:
+            filtered = await lookup.exists(data)
+        else:
+            backend = _backend(spider_ins, database)
+            filtered = await _call(
+                spider_ins,
+                database,
+                lambda: _read(
+                    spider_ins,
+                    backend,
+                    lambda reader: filter_func(data, reader, model, filters),
+                ),
+                breaker=backend.replica is None,
+            )
+    if filtered and cache is not None:
+        cache.add(data, filters)
+    return filtered
+
+
+def _remember(spider_ins: Spider, database: str, model: Model, data, filters):
+    bloom = spider_ins.bloom_filters.get((database, model))
+    if bloom is not None:
+        bloom.add(data)
+    cache = _filter_cache(spider_ins, database, model)
+    if cache is not None and filters:
+        cache.add(data, filters)
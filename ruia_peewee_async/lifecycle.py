@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import signal
+from time import perf_counter
+from typing import Awaitable, Callable, Sequence, Tuple
+
+from peewee import Model
+from peewee_async import Manager
+
+from .backend import Backend
+from .bloom import BloomFilter
+from .database import _connect, _models, _replica, create_model
+from .dispatch import _backend, _read
+from .metrics import DEFAULT_BUCKETS, Metrics
+from .pool import PoolMonitor
+from .profile import StageProfiler
+from .report import SummaryReporter
+from .retry import CircuitBreaker, RetryPolicy
+from .spider import Spider
+from .spool import Spool
+from .template import SqlTemplates
+
+# A feature's setup, called by init_spider, and its teardown, awaited by before_stop.
+Hook = Tuple[Callable[[Spider], None], Callable[[Spider], Awaitable[None]]]
+
+
+def _init_backends(spider_ins: Spider):
+    mysql_config = getattr(spider_ins, "mysql_config", {})
+    postgres_config = getattr(spider_ins, "postgres_config", {})
+    sqlite_config = getattr(spider_ins, "sqlite_config", {})
+    create_model(
+        spider_ins=spider_ins,
+        create_table=True,
+        mysql=mysql_config,
+        postgres=postgres_config,
+        sqlite=sqlite_config,
+    )
+    spider_ins.backends = {}
+    for kind, config in (
+        ("mysql", mysql_config),
+        ("postgres", postgres_config),
+        ("sqlite", sqlite_config),
+    ):
+        if hasattr(spider_ins, f"{kind}_model"):
+            spider_ins.backends[kind] = Backend(
+                kind,
+                kind,
+                getattr(spider_ins, f"{kind}_model"),
+                getattr(spider_ins, f"{kind}_manager"),
+                *_replica(kind, config),
+                _models(getattr(spider_ins, f"{kind}_manager"), config, True),
+            )
+    for name, config in (getattr(spider_ins, "backends_config", None) or {}).items():
+        spider_ins.backends[name.lower()] = _named_backend(name.lower(), config)
+    if getattr(spider_ins, "load_data_config", None) is not None:
+        for backend in spider_ins.backends.values():
+            if backend.kind == "mysql":
+                # LOAD DATA LOCAL INFILE is refused unless the client allows it.
+                backend.database.connect_params["local_infile"] = True
+    _shard_backends(spider_ins)
+
+
+def _named_backend(name: str, config) -> Backend:
+    kind = config["type"]
+    config = {key: val for key, val in config.items() if key != "type"}
+    config["model"] = dict(config["model"])
+    _, model, manager = _connect(kind, config, create_table=True)
+    return Backend(
+        name,
+        kind,
+        model,
+        manager,
+        *_replica(kind, config),
+        _models(manager, config, create_table=True),
+    )
+
+
+async def _close_backends(spider_ins: Spider):
+    for backend in getattr(spider_ins, "backends", {}).values():
+        await backend.manager.close()
+        if backend.replica is not None:
+            await backend.replica.close()
+
+
+def _init_metrics(spider_ins: Spider):
+    metrics_config = getattr(spider_ins, "metrics_config", None) or {}
+    spider_ins.metrics = Metrics(metrics_config.get("buckets", DEFAULT_BUCKETS))
+
+
+async def _close_metrics(spider_ins: Spider):
+    metrics_config = getattr(spider_ins, "metrics_config", None) or {}
+    if "path" in metrics_config:
+        spider_ins.metrics.dump(metrics_config["path"])
+    metrics_server = getattr(spider_ins, "metrics_server", None)
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+
+def _init_spool(spider_ins: Spider):
+    spool_config = getattr(spider_ins, "spool_config", None)
+    if spool_config is not None:
+        spider_ins.spool = Spool(
+            spool_config["path"],
+            spider_ins.logger,
+            spool_config.get("fsync", "batch"),
+            spool_config.get("fsync_interval", 1.0),
+        )
+
+
+async def _close_spool(spider_ins: Spider):
+    spool = getattr(spider_ins, "spool", None)
+    if spool is None:
+        return
+    spool.close()
+    if spool.pending:
+        spider_ins.logger.warning(
+            f"<RuiaPeeweeAsync: {spool.pending} writes left in the spool "
+            f"{spool.path}, they're replayed on the next start>"
+        )
+
+
+def _init_reporter(spider_ins: Spider):
+    summary_config = getattr(spider_ins, "summary_config", None)
+    if summary_config is not None:
+        spider_ins.reporter = SummaryReporter(spider_ins.logger, **summary_config)
+
+
+async def _close_reporter(spider_ins: Spider):
+    reporter = getattr(spider_ins, "reporter", None)
+    if reporter is not None:
+        reporter.flush()
+
+
+def _init_profiler(spider_ins: Spider):
+    profile_config = getattr(spider_ins, "profile_config", None)
+    spider_ins.profiler = None
+    if profile_config is None:
+        return
+    metrics_config = getattr(spider_ins, "metrics_config", None) or {}
+    spider_ins.profiler = StageProfiler(
+        spider_ins.logger,
+        **{
+            key: val
+            for key, val in profile_config.items()
+            if key not in ("start", "signal")
+        },
+        buckets=metrics_config.get("buckets", DEFAULT_BUCKETS),
+    )
+    if profile_config.get("start"):
+        spider_ins.profiler.profile()
+
+
+async def _close_profiler(spider_ins: Spider):
+    profiler = getattr(spider_ins, "profiler", None)
+    if profiler is None:
+        return
+    profiler.finish()
+    for stage, stats in profiler.stats().items():
+        spider_ins.logger.info(f"<RuiaPeeweeAsync: {stage} stage: {stats}>")
+    name = spider_ins.profile_config.get("signal")
+    if name:
+        try:
+            asyncio.get_event_loop().remove_signal_handler(getattr(signal, name))
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+
+
+def _init_breakers(spider_ins: Spider):
+    circuit_breaker_config = getattr(spider_ins, "circuit_breaker_config", None)
+    spider_ins.breakers = {}
+    if circuit_breaker_config is not None:
+        spider_ins.breakers = {
+            name: CircuitBreaker(name, spider_ins.logger, **circuit_breaker_config)
+            for name in spider_ins.backends
+        }
+
+
+async def _close_breakers(spider_ins: Spider):
+    for name, breaker in getattr(spider_ins, "breakers", {}).items():
+        if breaker.opened:
+            spider_ins.logger.info(
+                f"<RuiaPeeweeAsync: {name.upper()} circuit breaker opened "
+                f"{breaker.opened} times, it's {breaker.state}>"
+            )
+
+
+def _init_retry(spider_ins: Spider):
+    retry_config = getattr(spider_ins, "retry_config", None)
+    spider_ins.retry_policy = (
+        RetryPolicy(**retry_config) if retry_config is not None else None
+    )
+
+
+async def _close_retry(spider_ins: Spider):
+    retry_policy = getattr(spider_ins, "retry_policy", None)
+    if retry_policy is not None and retry_policy.retries:
+        spider_ins.logger.info(
+            f"<RuiaPeeweeAsync: retried {retry_policy.retries} database calls>"
+        )
+
+
+def _init_sql_templates(spider_ins: Spider):
+    sql_templates_config = getattr(spider_ins, "sql_templates_config", None)
+    spider_ins.sql_templates = (
+        SqlTemplates(**sql_templates_config)
+        if sql_templates_config is not None
+        else None
+    )
+
+
+async def _close_sql_templates(spider_ins: Spider):
+    sql_templates = getattr(spider_ins, "sql_templates", None)
+    if sql_templates is not None:
+        spider_ins.logger.info(
+            f"<RuiaPeeweeAsync: SQL templates: {sql_templates.stats()}>"
+        )
+
+
+async def _close_pools(spider_ins: Spider):
+    for name, monitor in getattr(spider_ins, "pools", {}).items():
+        spider_ins.logger.info(
+            f"<RuiaPeeweeAsync: {name.upper()} connection pool: {monitor.stats()}>"
+        )
+
+
+def _init_filters(spider_ins: Spider):
+    spider_ins.filter_caches = {}
+    spider_ins.bloom_filters = {}
+    spider_ins.filter_lookups = {}
+
+
+async def _close_filters(spider_ins: Spider):
+    for (database, model), cache in getattr(spider_ins, "filter_caches", {}).items():
+        spider_ins.logger.info(
+            f"<RuiaPeeweeAsync: {database.upper()} {model.__name__} "
+            f"filter cache: {cache.stats()}>"
+        )
+
+
+def _init_buffers(spider_ins: Spider):
+    spider_ins.insert_buffers = {}
+    spider_ins.bulk_buffers = {}
+    spider_ins.update_buffers = {}
+
+
+async def _close_buffers(spider_ins: Spider):
+    for buffer in getattr(spider_ins, "insert_buffers", {}).values():
+        await buffer.flush()
+    for buffer in getattr(spider_ins, "bulk_buffers", {}).values():
+        await buffer.flush()
+        await buffer.close()
+    for buffer in getattr(spider_ins, "update_buffers", {}).values():
+        await buffer.flush()
+
+
+def _shard_backends(spider_ins: Spider):
+    """Check the sharded backends exist, or register a backend per suffixed table."""
+    sharding_config = getattr(spider_ins, "sharding_config", None)
+    if sharding_config is None:
+        return
+    for name in sharding_config.get("backends", ()):
+        _backend(spider_ins, name.lower())
+    for kind in ("mysql", "postgres", "sqlite"):
+        backend = spider_ins.backends.get(kind)
+        if backend is None:
+            continue
+        for shard in range(sharding_config.get("tables", 0)):
+            spider_ins.backends[f"{kind}_{shard}"] = Backend(
+                f"{kind}_{shard}",
+                kind,
+                _shard_model(backend.manager, backend.model, shard),
+                backend.manager,
+                backend.replica,
+                backend.fallback,
+                {
+                    name: _shard_model(backend.manager, model, shard)
+                    for name, model in backend.models.items()
+                },
+            )
+
+
+def _shard_model(manager, model: Model, shard: int) -> Model:
+    table_name = f"{model._meta.table_name}_{shard}"  # pylint: disable=protected-access
+    # A subclass gets copies of the fields and the database of the model.
+    sharded = type(
+        table_name,
+        (model,),
+        {"Meta": type("Meta", (object,), {"table_name": table_name})},
+    )
+    with manager.allow_sync():
+        sharded.create_table(True)
+    return sharded
+
+
+def _monitor_pools(spider_ins: Spider):
+    """Watch the connection pool of every database and replica of the backends."""
+    adaptive_pool_config = getattr(spider_ins, "adaptive_pool_config", None)
+    spider_ins.pools = {}
+    monitors = {}
+    for name, backend in spider_ins.backends.items():
+        managers = [(name, backend.manager)]
+        if backend.replica is not None:
+            managers.append((f"{name}_replica", backend.replica))
+        for pool_name, manager in managers:
+            if not isinstance(manager, Manager):
+                # SQLite has no connection pool.
+                continue
+            database = manager.database
+            if id(database) not in monitors:
+                monitors[id(database)] = PoolMonitor(
+                    pool_name,
+                    database,
+                    spider_ins.logger,
+                    adaptive=adaptive_pool_config is not None,
+                    **(adaptive_pool_config or {}),
+                )
+            spider_ins.pools[pool_name] = monitors[id(database)]
+
+
+def _pool_size(spider_ins: Spider) -> int:
+    # A write to several backends holds a connection of each pool.
+    return min(
+        getattr(backend.database, "max_connections", 1)
+        for backend in spider_ins.backends.values()
+    )
+
+
+async def prewarm_bloom_filters(spider_ins: Spider):
+    """Load the filters values of the existing rows into a Bloom filter per model.
+
+    The models of the ``models`` configs without the filters columns get none.
+    """
+    bloom_config = getattr(spider_ins, "bloom_config", None)
+    if bloom_config is None:
+        return
+    filters = bloom_config["filters"]
+    if isinstance(filters, str):
+        filters = [filters]
+    for database, backend in spider_ins.backends.items():
+        for model in (backend.model, *backend.models.values()):
+            if model is backend.model or all(
+                fil in model._meta.fields  # pylint: disable=protected-access
+                for fil in filters
+            ):
+                await _prewarm_bloom_filter(
+                    spider_ins, database, backend, model, filters
+                )
+
+
+async def _prewarm_bloom_filter(
+    spider_ins: Spider, database: str, backend: Backend, model: Model, filters
+):
+    bloom_config = spider_ins.bloom_config
+    chunk_size = bloom_config.get("chunk_size", 10000)
+    start = perf_counter()
+    capacity = bloom_config.get("capacity")
+    if not capacity:
+        count = await _read(
+            spider_ins, backend, lambda reader: reader.count(model.select())
+        )
+        capacity = max(2 * count, 10000)
+    bloom = BloomFilter(filters, capacity, bloom_config.get("error_rate", 0.01), model)
+    async for rows in _chunks(spider_ins, backend, model, filters, chunk_size):
+        for row in rows:
+            bloom.add(row)
+    spider_ins.bloom_filters[(database, model)] = bloom
+    spider_ins.logger.info(
+        f"<RuiaPeeweeAsync: {database.upper()} bloom filter prewarmed with "
+        f"{bloom.count} keys of {filters} from {model.__name__} "
+        f"in {perf_counter() - start:.3f}s, {bloom.nbytes} bytes for {bloom.capacity} keys>"
+    )
+
+
+async def _chunks(
+    spider_ins: Spider, backend: Backend, model: Model, filters, chunk_size: int
+):
+    """Read the filters columns of every row in chunks, paginated on the primary key."""
+    primary_key = model._meta.primary_key  # pylint: disable=protected-access
+    columns = [getattr(model, fil) for fil in filters]
+    last = None
+    while True:
+        query = model.select(primary_key, *columns).order_by(primary_key)
+        if last is not None:
+            query = query.where(primary_key > last)
+        query = query.limit(chunk_size).dicts()
+        rows = list(
+            await _read(
+                spider_ins,
+                backend,
+                lambda reader, query=query: reader.execute(query),
+            )
+        )
+        yield rows
+        if len(rows) < chunk_size:
+            break
+        last = rows[-1][primary_key.name]
+
+
+def _profile_on_signal(spider_ins: Spider):
+    """Start a profiling run whenever the process receives the configured signal."""
+    name = (getattr(spider_ins, "profile_config", None) or {}).get("signal")
+    if not name:
+        return
+    try:
+        asyncio.get_event_loop().add_signal_handler(
+            getattr(signal, name), spider_ins.profiler.profile
+        )
+    except (NotImplementedError, RuntimeError, ValueError) as exc:
+        spider_ins.logger.warning(f"<RuiaPeeweeAsync: can't profile on {name}: {exc}>")
+
+
+# The features in the order they're set up, they're torn down in the reverse order.
+FEATURES: Tuple[Hook, ...] = (
+    (_init_backends, _close_backends),
+    (_init_metrics, _close_metrics),
+    (_init_spool, _close_spool),
+    (_init_reporter, _close_reporter),
+    (_init_profiler, _close_profiler),
+    (_init_breakers, _close_breakers),
+    (_init_retry, _close_retry),
+    (_init_sql_templates, _close_sql_templates),
+    (_monitor_pools, _close_pools),
+    (_init_filters, _close_filters),
+    (_init_buffers, _close_buffers),
+)
+
+
+def setup_spider(spider_ins: Spider, features: Sequence[Hook] = FEATURES):
+    for init, _ in features:
+        init(spider_ins)
+
+
+async def close_spider(spider_ins: Spider, features: Sequence[Hook] = FEATURES):
+    for _, close in reversed(features):
+        await close(spider_ins)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from peewee import SQL, Model, Select, fn
+from peewee_async import Manager
+
+# The most keys checked by one query, each is a column of its result.
+MAX_KEYS = 500
+
+
+class FilterLookup:  # pylint: disable=too-many-instance-attributes
+    """Coalesce concurrent filter checks of one table into a single query.
+
+    The query has an ``EXISTS`` per key with the condition of ``filter_func``, so the
+    keys are matched by the database, with the collations of its columns.
+    """
+
+    def __init__(
+        self,
+        manager: Manager,
+        model: Model,
+        filters: Sequence[str],
+        window: float = 0.005,
+        size: int = 100,
+        execute: Optional[Callable[..., Awaitable]] = None,
+    ) -> None:
+        """
+
+        Args:
+            manager: The peewee-async manager of the target database.
+            model: The peewee model to look up.
+            filters: The columns the lookups match on.
+            window: Seconds to wait for more lookups before the query is sent.
+            size: Send the query right away when this many keys are waiting.
+            execute: Runs the query instead of the manager, e.g. on a read replica.
+
+        """
+
+        self.manager = manager
+        self.execute = execute or manager.execute
+        self.model = model
+        self.filters = tuple(filters)
+        self.window = window
+        self.size = size
+        self.queries = 0
+        self.lookups = 0
+        self._fields = [getattr(model, fil) for fil in self.filters]
+        self._waiting: Dict[Tuple, asyncio.Future] = {}
+        self._timer = None
+
+    def _key(self, data: Dict) -> Tuple:
+        # Compare values the way they come back from the database.
+        return tuple(
+            field.python_value(field.db_value(data[field.name]))
+            for field in self._fields
+        )
+
+    async def exists(self, data: Dict) -> bool:
+        key = self._key(data)
+        self.lookups += 1
+        future = self._waiting.get(key)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._waiting[key] = future
+            if len(self._waiting) >= self.size:
+                self._send()
+            elif self._timer is None:
+                self._timer = asyncio.get_event_loop().call_later(
+                    self.window, self._send
+                )
+        return await asyncio.shield(future)
+
+    def _send(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        waiting, self._waiting = self._waiting, {}
+        asyncio.ensure_future(self._lookup(waiting))
+
+    def _query(self, keys: Sequence[Tuple]) -> Select:
+        database = self.model._meta.database  # pylint: disable=protected-access
+        return (
+            Select(
+                columns=[
+                    fn.EXISTS(
+                        self.model.select(SQL("1")).where(
+                            *[field == val for field, val in zip(self._fields, key)]
+                        )
+                    )
+                    for key in keys
+                ]
+            )
+            .bind(database)
+            .tuples()
+        )
+
+    async def _lookup(self, waiting: Dict[Tuple, asyncio.Future]):
+        keys = list(waiting)
+        for start in range(0, len(keys), MAX_KEYS):
+            chunk = keys[start : start + MAX_KEYS]
+            self.queries += 1
+            try:
+                rows = list(await self.execute(self._query(chunk)))
+            except Exception as exc:  # pylint: disable=broad-except
+                for key in keys[start:]:
+                    if not waiting[key].done():
+                        waiting[key].set_exception(exc)
+                return
+            for key, found in zip(chunk, rows[0]):
+                if not waiting[key].done():
+                    waiting[key].set_result(bool(found))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, List, Sequence, Tuple
+
+# Seconds, from a cached lookup to a saturated database.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+PREFIX = "ruia_peewee_async"
+
+
+class Histogram:
+    """Latency observations counted into fixed buckets."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """The ``(le, count)`` pairs of a Prometheus histogram, ending with ``+Inf``."""
+        pairs, total = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return pairs
+
+
+class OperationStats:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.latency = Histogram(buckets)
+
+
+class Metrics:
+    """Counts, errors, rows and latency of the database operations, per database."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+
+        Args:
+            buckets: The upper bounds in seconds of the latency histogram buckets.
+
+        """
+
+        self.buckets = tuple(buckets)
+        self.started = perf_counter()
+        self.operations: Dict[Tuple[str, str], OperationStats] = {}
+
+    def observe(
+        self,
+        database: str,
+        operation: str,
+        seconds: float,
+        rows: int = 1,
+        error: bool = False,
+    ) -> None:
+        key = (database, operation)
+        stats = self.operations.get(key)
+        if stats is None:
+            stats = self.operations[key] = OperationStats(self.buckets)
+        stats.count += 1
+        stats.latency.observe(seconds)
+        if error:
+            stats.errors += 1
+        else:
+            stats.rows += rows
+
+    @contextmanager
+    def timer(self, database: str, operation: str, rows: int = 1, expected: Tuple = ()):
+        """Time the enclosed operation, exceptions that aren't ``expected`` count as errors."""
+        start = perf_counter()
+        try:
+            yield
+        except expected:
+            self.observe(database, operation, perf_counter() - start, 0)
+            raise
+        except Exception:
+            self.observe(database, operation, perf_counter() - start, error=True)
+            raise
+        self.observe(database, operation, perf_counter() - start, rows)
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict]:
+        elapsed = perf_counter() - self.started
+        return {
+            key: {
+                "count": stats.count,
+                "errors": stats.errors,
+                "rows": stats.rows,
+                "rows_per_second": stats.rows / elapsed if elapsed else 0.0,
+                "latency_sum": stats.latency.sum,
+                "latency_buckets": stats.latency.cumulative(),
+            }
+            for key, stats in self.operations.items()
+        }
+
+    def prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text, values):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for (database, operation), value in values:
+                labels = f'database="{database}",operation="{operation}"'
+                lines.append(f"{PREFIX}_{name}{{{labels}}} {value}")
+
+        for name, kind, help_text, stat in (
+            ("operations_total", "counter", "Database operations.", "count"),
+            ("errors_total", "counter", "Failed database operations.", "errors"),
+            ("rows_total", "counter", "Rows written or read.", "rows"),
+            (
+                "rows_per_second",
+                "gauge",
+                "Rows per second since start.",
+                "rows_per_second",
+            ),
+        ):
+            family(
+                name,
+                kind,
+                help_text,
+                [(key, val[stat]) for key, val in snapshot.items()],
+            )
+        name = f"{PREFIX}_latency_seconds"
+        lines.append(f"# HELP {name} Database operation latency.")
+        lines.append(f"# TYPE {name} histogram")
+        for (database, operation), val in snapshot.items():
+            labels = f'database="{database}",operation="{operation}"'
+            for bound, count in val["latency_buckets"]:
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {val['latency_sum']}")
+            lines.append(f"{name}_count{{{labels}}} {val['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.prometheus())
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100):
+        """Serve the Prometheus text on every HTTP request, returns the ``asyncio`` server."""
+
+        async def handle(reader, writer):
+            try:
+                while (await reader.readline()).strip():
+                    pass
+                body = self.prometheus().encode("utf-8")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/plain; version=0.0.4\r\n"
+                    + f"Content-Length: {len(body)}\r\n".encode("ascii")
+                    + b"Connection: close\r\n\r\n"
+                    + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
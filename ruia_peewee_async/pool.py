@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from time import monotonic, perf_counter
+from typing import Dict, Optional
+
+
+class PoolUsage:
+    """The acquires and resizes of a pool since it was created."""
+
+    __slots__ = ("acquires", "waiting", "wait_total", "wait_max", "resizes")
+
+    def __init__(self) -> None:
+        self.acquires = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.resizes = 0
+
+
+class PoolWindow:
+    """What a pool went through since its size was last decided."""
+
+    __slots__ = ("start", "acquires", "wait", "held", "releases", "peak")
+
+    def __init__(self) -> None:
+        self.start = monotonic()
+        self.acquires = 0
+        self.wait = 0.0
+        self.held = 0.0
+        self.releases = 0
+        self.peak = 0
+
+
+class ResizePolicy:
+    """The bounds of a pool and, when it's adaptive, when and how much it's resized."""
+
+    __slots__ = ("lower", "upper", "adaptive", "interval", "wait", "latency")
+
+    def __init__(
+        self,
+        lower: int,
+        upper: int,
+        adaptive: bool = False,
+        interval: float = 5.0,
+        wait: float = 0.005,
+    ) -> None:
+        self.lower = lower
+        self.upper = upper
+        self.adaptive = adaptive
+        self.interval = interval
+        self.wait = wait
+        # The mean time a connection was held over the last window with releases.
+        self.latency: Optional[float] = None
+
+    def size(self, maxsize: int, window: PoolWindow) -> int:
+        """The size of the pool after the window, ``maxsize`` when it's kept."""
+        wait = window.wait / window.acquires if window.acquires else 0
+        latency = window.held / window.releases if window.releases else None
+        size = maxsize
+        if wait > self.wait and maxsize < self.upper:
+            # The database is saturated when more connections only slow the queries.
+            if self.latency is None or latency is None or latency < 1.5 * self.latency:
+                size = min(self.upper, maxsize + max(1, maxsize // 2))
+        elif (
+            wait < self.wait / 10
+            and 2 * window.peak <= maxsize
+            and maxsize > self.lower
+        ):
+            size = max(self.lower, maxsize - max(1, maxsize // 4))
+        if latency is not None:
+            self.latency = latency
+        return size
+
+
+class PoolMonitor:
+    """Usage and acquire waits of a database's connection pool, optionally resized.
+
+    In the adaptive mode the pool starts at ``min_connections`` and, every interval,
+    grows while acquiring a connection takes longer than ``wait`` and the queries don't
+    slow down, and shrinks while it barely waits and half of it stays idle,
+    staying within ``min_connections`` and ``max_connections``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        database,
+        logger,
+        adaptive: bool = False,
+        interval: float = 5.0,
+        wait: float = 0.005,
+    ) -> None:
+        """
+
+        Args:
+            name: The name of the backend, used in the log messages.
+            database: The peewee-async database whose pool is watched.
+            logger: The spider's logger.
+            adaptive: Whether the pool is resized.
+            interval: Seconds between two resizes.
+            wait: The mean acquire wait in seconds over which the pool grows.
+
+        """
+
+        self.name = name
+        self.logger = logger
+        lower = max(getattr(database, "min_connections", 1), 1)
+        self.policy = ResizePolicy(
+            lower,
+            max(getattr(database, "max_connections", 1), lower),
+            adaptive,
+            interval,
+            wait,
+        )
+        self.usage = PoolUsage()
+        self._window = PoolWindow()
+        self._pool = None
+        self._held: Dict[int, float] = {}
+        # peewee-async builds the pool from this class when it connects.
+        database._async_conn_cls = self._connection_class(
+            database._async_conn_cls  # pylint: disable=protected-access
+        )
+
+    def _connection_class(self, conn_cls):
+        monitor = self
+
+        class MonitoredConnection(conn_cls):
+            async def acquire(self):
+                monitor.usage.waiting += 1
+                start = perf_counter()
+                try:
+                    conn = await super().acquire()
+                finally:
+                    monitor.usage.waiting -= 1
+                monitor.acquired(self.pool, conn, perf_counter() - start)
+                return conn
+
+            def release(self, conn):
+                monitor.released(conn)
+                super().release(conn)
+
+        return MonitoredConnection
+
+    def acquired(self, pool, conn, seconds: float) -> None:
+        if self._pool is None:
+            self._pool = pool
+            if self.policy.adaptive:
+                self._resize(self.policy.lower)
+        usage, window = self.usage, self._window
+        usage.acquires += 1
+        usage.wait_total += seconds
+        usage.wait_max = max(usage.wait_max, seconds)
+        window.acquires += 1
+        window.wait += seconds
+        window.peak = max(window.peak, self.in_use)
+        self._held[id(conn)] = perf_counter()
+        self._tick()
+
+    def released(self, conn) -> None:
+        start = self._held.pop(id(conn), None)
+        if start is not None:
+            self._window.held += perf_counter() - start
+            self._window.releases += 1
+        self._tick()
+
+    @property
+    def maxsize(self) -> int:
+        return self._pool.maxsize if self._pool is not None else self.policy.upper
+
+    @property
+    def in_use(self) -> int:
+        return self._pool.size - self._pool.freesize if self._pool is not None else 0
+
+    @property
+    def idle(self) -> int:
+        return self._pool.freesize if self._pool is not None else 0
+
+    def _tick(self) -> None:
+        policy = self.policy
+        if policy.adaptive and monotonic() - self._window.start >= policy.interval:
+            self._adapt()
+
+    def _adapt(self) -> None:
+        """Resize the pool from what the last interval observed."""
+        maxsize = self.maxsize
+        size = self.policy.size(maxsize, self._window)
+        if size != maxsize:
+            self._resize(size)
+        self._window = PoolWindow()
+
+    def _resize(self, maxsize: int) -> None:
+        # aiomysql and aiopg cap the pool with the length of its deque of free
+        # connections. The idle connections over the new size are closed first,
+        # the deque is never made shorter than the pool so a release can't drop one.
+        pool = self._pool
+        free = pool._free  # pylint: disable=protected-access
+        while free and pool.size > maxsize:
+            free.pop().close()
+        old = pool.maxsize
+        pool._free = deque(  # pylint: disable=protected-access
+            free, maxlen=max(maxsize, pool.size)
+        )
+        if pool.maxsize != old:
+            self.usage.resizes += 1
+            self.logger.info(
+                f"<RuiaPeeweeAsync: {self.name.upper()} connection pool "
+                f"resized from {old} to {pool.maxsize}>"
+            )
+
+    def stats(self) -> Dict:
+        usage = self.usage
+        return {
+            "size": self._pool.size if self._pool is not None else 0,
+            "maxsize": self.maxsize,
+            "in_use": self.in_use,
+            "idle": self.idle,
+            "waiting": usage.waiting,
+            "acquires": usage.acquires,
+            "wait_mean": usage.wait_total / usage.acquires if usage.acquires else 0.0,
+            "wait_max": usage.wait_max,
+            "resizes": usage.resizes,
+        }
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager, nullcontext
+from time import perf_counter
+from typing import Callable, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import DEFAULT_BUCKETS, Histogram
+
+# What a stage is when nothing is profiled.
+NO_STAGE = nullcontext()
+
+# A hook is called with the stage and the database, None outside the database
+# stages, and returns the context manager that encloses the stage.
+Hook = Callable[[str, Optional[str]], ContextManager]
+
+
+class SamplingProfiler:
+    """Sample the stack of a thread every ``interval`` seconds from a thread of its own.
+
+    Unlike cProfile it barely slows the sampled thread down, at the cost of
+    missing what runs between two samples. The event loop waiting for the
+    databases shows up as its ``select``.
+    """
+
+    def __init__(self, interval: float = 0.001, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enable(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="ruia-peewee-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def disable(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self.thread_id
+            )
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} "
+                    f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def top(self, limit: int = 20) -> List[Tuple[str, int, int]]:
+        """The functions with the most samples: ``(function, own, total)``."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.samples.items():
+            functions = stack.split(";")
+            own[functions[-1]] += count
+            for function in set(functions):
+                total[function] += count
+        return [
+            (function, own[function], count)
+            for function, count in total.most_common(limit)
+        ]
+
+    def dump(self, path: str) -> None:
+        """Write the samples as collapsed stacks, the input of flame graph tools."""
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.samples.items():
+                file.write(f"{stack} {count}\n")
+
+
+class StageProfiler:  # pylint: disable=too-many-instance-attributes
+    """Times the stages of handling the callback results and runs the hooks around them.
+
+    The stages are ``validation``, ``filter``, ``lookup``, ``write`` and ``logging``,
+    all within the ``item`` stage, whose time they don't account for is overhead.
+    ``profile`` also turns cProfile or the sampling profiler on until a number of
+    items have been handled, then logs where the time went.
+    """
+
+    def __init__(
+        self,
+        logger,
+        hooks: Sequence[Hook] = (),
+        timer: bool = True,
+        mode: str = "cprofile",
+        items: int = 1000,
+        path: Optional[str] = None,
+        interval: float = 0.001,
+        top: int = 20,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        """
+
+        Args:
+            logger: The spider's logger.
+            hooks: Called with the stage and the database, they return the context manager enclosing the stage.
+            timer: Whether the stages are timed.
+            mode: The profiler of ``profile``, ``cprofile`` or ``sampling``.
+            items: The items a ``profile`` run lasts by default.
+            path: Where the runs are saved, suffixed with their number: pstats files or collapsed stacks.
+            interval: Seconds between two samples of the sampling profiler.
+            top: The functions logged at the end of a run.
+            buckets: The upper bounds in seconds of the stage histograms.
+
+        """
+
+        self.logger = logger
+        self.hooks = tuple(hooks)
+        self.timer = timer
+        self.mode = mode
+        self.items = items
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.buckets = tuple(buckets)
+        self.histograms: Dict[str, Histogram] = {}
+        self.maxima: Dict[str, float] = {}
+        self.runs = 0
+        self._profiler = None
+        self._remaining = 0
+
+    def stage(self, name: str, database: Optional[str] = None) -> ContextManager:
+        if not self.hooks:
+            return self._timed(name) if self.timer else NO_STAGE
+        return self._hooked(name, database)
+
+    @contextmanager
+    def _hooked(self, name: str, database: Optional[str]):
+        with ExitStack() as stack:
+            for hook in self.hooks:
+                stack.enter_context(hook(name, database))
+            if self.timer:
+                stack.enter_context(self._timed(name))
+            yield
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def observe(self, name: str, seconds: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        if seconds > self.maxima.get(name, 0.0):
+            self.maxima[name] = seconds
+
+    def profile(self, items: Optional[int] = None, mode: Optional[str] = None) -> None:
+        """Profile the handling of the next ``items`` items, unless a run is going on."""
+        if self._profiler is not None:
+            return
+        self.runs += 1
+        self._remaining = items or self.items
+        mode = mode or self.mode
+        if mode == "sampling":
+            self._profiler = SamplingProfiler(self.interval)
+        else:
+            self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        self.logger.info(
+            f"<RuiaPeeweeAsync: profiling the next {self._remaining} items with {mode}>"
+        )
+
+    def item_done(self) -> None:
+        if self._profiler is None:
+            return
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self.finish()
+
+    def finish(self) -> None:
+        """End the profiling run, logging the functions the time went to."""
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        profiler.disable()
+        path = f"{self.path}.{self.runs}" if self.path else None
+        if isinstance(profiler, SamplingProfiler):
+            lines = [
+                f"{own:>8} {total:>8}  {function}"
+                for function, own, total in profiler.top(self.top)
+            ]
+            report = f"{'own':>8} {'total':>8}  samples\n" + "\n".join(lines)
+            if path:
+                profiler.dump(path)
+        else:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(self.top)
+            report = stream.getvalue()
+            if path:
+                profiler.dump_stats(path)
+        self.logger.info(
+            f"<RuiaPeeweeAsync: profile run {self.runs}"
+            f"{f' saved to {path}' if path else ''}:\n{report}>"
+        )
+
+    def stats(self) -> Dict[str, Dict]:
+        """The count, total, mean and max seconds of every stage timed."""
+        return {
+            name: {
+                "count": histogram.count,
+                "total": histogram.sum,
+                "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                "max": self.maxima.get(name, 0.0),
+            }
+            for name, histogram in self.histograms.items()
+        }
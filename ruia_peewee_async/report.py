@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+from logging import DEBUG
+from time import monotonic
+from typing import List, Tuple
+
+INSERTED = "inserted"
+BUFFERED = "buffered"
+FILTERED = "filtered"
+CREATED = "created"
+UPDATED = "updated"
+UPSERTED = "upserted"
+SKIPPED = "skipped"
+SPOOLED = "spooled"
+FAILED = "failed"
+
+
+class Report:
+    """The outcomes of one item and its log message, formatted only when it's logged."""
+
+    __slots__ = ("outcomes", "_lines")
+
+    def __init__(self) -> None:
+        self.outcomes: Counter = Counter()
+        self._lines: List[Tuple[str, tuple]] = []
+
+    def count(self, database: str, outcome: str) -> "Report":
+        self.outcomes[(database.upper(), outcome)] += 1
+        return self
+
+    def add(self, template: str, *args) -> "Report":
+        """Add a line, ``template`` is a ``str.format`` template of ``args``."""
+        self._lines.append((template, args))
+        return self
+
+    def extend(self, other: "Report") -> "Report":
+        self.outcomes.update(other.outcomes)
+        self._lines.extend(other._lines)  # pylint: disable=protected-access
+        return self
+
+    def __bool__(self) -> bool:
+        return bool(self._lines)
+
+    def __str__(self) -> str:
+        return "\n".join(template.format(*args) for template, args in self._lines)
+
+
+class SummaryReporter:
+    """Aggregate the outcomes of the items into a summary line logged every interval.
+
+    The messages of the items are only logged at DEBUG.
+    """
+
+    def __init__(self, logger, interval: float = 60.0) -> None:
+        """
+
+        Args:
+            logger: The spider's logger.
+            interval: Seconds between two summary lines.
+
+        """
+
+        self.logger = logger
+        self.interval = interval
+        self.totals: Counter = Counter()
+        self._window: Counter = Counter()
+        self._last = monotonic()
+
+    def record(self, report: Report) -> None:
+        self._window.update(report.outcomes)
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.debug(report)
+        if monotonic() - self._last >= self.interval:
+            self.flush()
+
+    def error(self, database: str) -> None:
+        self._window[(database.upper(), FAILED)] += 1
+
+    def flush(self) -> None:
+        """Log the outcomes counted since the last summary."""
+        elapsed = monotonic() - self._last
+        self._last = monotonic()
+        if not self._window:
+            return
+        self.totals.update(self._window)
+        self.logger.info(
+            f"<RuiaPeeweeAsync: summary of the last {elapsed:.1f}s: "
+            f"{_format(self._window)}, total: {_format(self.totals)}>"
+        )
+        self._window = Counter()
+
+
+def _format(counts: Counter) -> str:
+    databases = sorted({database for database, _ in counts})
+    return "; ".join(
+        f"{database} "
+        + " ".join(
+            f"{outcome}={count}"
+            for (name, outcome), count in sorted(counts.items())
+            if name == database
+        )
+        for database in databases
+    )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from random import uniform
+from time import monotonic
+
+from pymysql import OperationalError
+
+# The MySQL errors that may not happen again: too many connections, lock wait
+# timeout, deadlock and the client's refused or lost connections.
+TRANSIENT_MYSQL_ERRORS = frozenset((1040, 1205, 1213, 2003, 2006, 2013, 2055))
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether a database error is worth retrying, unlike an unknown column or table.
+
+    peewee wraps the driver's error, which it keeps as ``orig``.
+    """
+    exc = getattr(exc, "orig", None) or exc
+    if isinstance(exc, OperationalError) and exc.args and isinstance(exc.args[0], int):
+        return exc.args[0] in TRANSIENT_MYSQL_ERRORS
+    return True
+
+
+class CircuitOpenError(OperationalError):
+    """Raised instead of calling a database whose circuit breaker is open."""
+
+
+class RetryPolicy:
+    """Retry a call that failed with a transient error, after a jittered exponential backoff."""
+
+    def __init__(self, attempts: int = 3, base: float = 0.05, cap: float = 2.0) -> None:
+        """
+
+        Args:
+            attempts: The number of calls, the first one included.
+            base: The backoff in seconds before the second call, it doubles at each retry.
+            cap: The maximum backoff in seconds.
+
+        """
+
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.retries = 0
+
+    def backoff(self, attempt: int) -> float:
+        """A uniform wait below the exponential backoff, so the workers don't retry in step."""
+        return uniform(0, min(self.cap, self.base * 2**attempt))
+
+
+class CircuitBreaker:  # pylint: disable=too-many-instance-attributes
+    """Stop calling a database after ``threshold`` failures in a row.
+
+    The circuit opens for ``reset`` seconds, then lets a single call through:
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(
+        self, name: str, logger, threshold: int = 5, reset: float = 30.0
+    ) -> None:
+        """
+
+        Args:
+            name: The database name, used in the log messages.
+            logger: The spider's logger.
+            threshold: The consecutive failures that open the circuit.
+            reset: Seconds the circuit stays open before a trial call.
+
+        """
+
+        self.name = name
+        self.logger = logger
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if monotonic() - self._opened_at < self.reset:
+            return "open"
+        return "half-open"
+
+    def check(self) -> None:
+        """Raise CircuitOpenError unless the database can be called."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return
+        raise CircuitOpenError(
+            2003, f"circuit breaker of {self.name.upper()} is {state}"
+        )
+
+    def success(self) -> None:
+        if self._opened_at is not None:
+            self.logger.info(
+                f"<RuiaPeeweeAsync: {self.name.upper()} circuit breaker closed>"
+            )
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial or (self._opened_at is None and self.failures >= self.threshold):
+            self.opened += 1
+            self._opened_at = monotonic()
+            self._trial = False
+            self.logger.error(
+                f"<RuiaPeeweeAsync: {self.name.upper()} circuit breaker opened "
+                f"for {self.reset}s after {self.failures} failures>"
+            )
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from enum import Enum
+from typing import Callable, Dict
+from typing import Optional as TOptional
+from typing import Tuple, Union
+
+from peewee import Model, SqliteDatabase
+from peewee_async import (
+    AsyncQueryWrapper,
+    Manager,
+    MySQLDatabase,
+    PooledMySQLDatabase,
+    PooledPostgresqlDatabase,
+    PostgresqlDatabase,
+)
+from ruia import Spider as RuiaSpider
+
+from .backend import Backend
+from .bloom import BloomFilter
+from .buffer import InsertBuffer, UpdateBuffer
+from .cache import FilterCache
+from .lookup import FilterLookup
+from .metrics import Metrics
+from .pool import PoolMonitor
+from .profile import StageProfiler
+from .report import SummaryReporter
+from .retry import CircuitBreaker, RetryPolicy
+from .sqlite import SqliteManager
+from .template import SqlTemplates
+from .writer import WriteQueue
+
+
+class Spider(RuiaSpider):
+    mysql_model: Model
+    mysql_manager: Manager
+    postgres_model: Model
+    postgres_manager: Manager
+    mysql_db: Union[MySQLDatabase, PooledMySQLDatabase]
+    postgres_db: Union[PostgresqlDatabase, PooledPostgresqlDatabase]
+    mysql_filters: TOptional[AsyncQueryWrapper]
+    postgres_filters: TOptional[AsyncQueryWrapper]
+    sqlite_model: Model
+    sqlite_manager: SqliteManager
+    sqlite_db: SqliteDatabase
+    process_insert_callback_result: Callable
+    process_update_callback_result: Callable
+    batch_config: Dict
+    insert_buffers: Dict[Tuple[str, Model], InsertBuffer]
+    copy_config: Dict
+    load_data_config: Dict
+    bulk_buffers: Dict[Tuple[str, Model], InsertBuffer]
+    update_batch_config: Dict
+    update_buffers: Dict[Tuple, UpdateBuffer]
+    filter_cache_config: Dict
+    filter_caches: Dict[Tuple[str, Model], FilterCache]
+    filter_batch_config: Dict
+    filter_lookups: Dict[Tuple[str, Model, Tuple[str, ...]], FilterLookup]
+    bloom_config: Dict
+    bloom_filters: Dict[Tuple[str, Model], BloomFilter]
+    write_queue_config: Dict
+    write_queue: WriteQueue
+    metrics_config: Dict
+    metrics: Metrics
+    summary_config: Dict
+    reporter: SummaryReporter
+    backends_config: Dict[str, Dict]
+    backends: Dict[str, Backend]
+    sharding_config: Dict
+    adaptive_pool_config: Dict
+    pools: Dict[str, PoolMonitor]
+    retry_config: Dict
+    retry_policy: TOptional[RetryPolicy]
+    circuit_breaker_config: Dict
+    breakers: Dict[str, CircuitBreaker]
+    sql_templates_config: Dict
+    sql_templates: TOptional[SqlTemplates]
+    profile_config: Dict
+    profiler: TOptional[StageProfiler]
+
+
+class TargetDB(Enum):
+    MYSQL = 0
+    POSTGRES = 1
+    BOTH = 2
+    SQLITE = 3
+
+
+TARGET_DATABASES = {
+    TargetDB.MYSQL: (TargetDB.MYSQL.name,),
+    TargetDB.POSTGRES: (TargetDB.POSTGRES.name,),
+    TargetDB.BOTH: (TargetDB.MYSQL.name, TargetDB.POSTGRES.name),
+    TargetDB.SQLITE: (TargetDB.SQLITE.name,),
+}
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import pickle
+import struct
+from time import monotonic
+from typing import Awaitable, Callable, Iterator, Tuple
+from zlib import crc32
+
+# Every record is its length and CRC-32 followed by the pickled record.
+HEADER = struct.Struct(">II")
+
+
+class Spool:  # pylint: disable=too-many-instance-attributes
+    """An append-only file of the writes that couldn't reach their database.
+
+    ``replay`` moves the file aside and applies its records in order, stopping at the
+    first one that fails again and resuming from there on the next call, so the writes
+    spooled meanwhile go to a new file. A record is applied at least once: a crash
+    during a replay replays it again on the next start.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        logger,
+        fsync: str = "batch",
+        fsync_interval: float = 1.0,
+    ) -> None:
+        """
+
+        Args:
+            path: The spool file, ``<path>.replay`` is the one being replayed.
+            logger: The spider's logger.
+            fsync: ``always`` syncs every record to disk, ``batch`` syncs at most every
+                ``fsync_interval`` seconds and ``never`` leaves it to the OS.
+            fsync_interval: Seconds between two syncs in the ``batch`` mode.
+
+        """
+
+        self.path = path
+        self.replay_path = f"{path}.replay"
+        self.logger = logger
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.appended = 0
+        self.replayed = 0
+        self.pending = sum(1 for _ in self._read(self.replay_path)) + sum(
+            1 for _ in self._read(path)
+        )
+        self._offset = 0
+        self._file = None
+        self._synced = monotonic()
+        self._timer = None
+        self._replaying = False
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def append(self, record: Tuple) -> None:
+        """Write a record, raises if it can't be pickled."""
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        if self._file is None:
+            self._file = open(self.path, "ab")  # pylint: disable=consider-using-with
+        self._file.write(HEADER.pack(len(payload), crc32(payload)) + payload)
+        self._file.flush()
+        self.appended += 1
+        self.pending += 1
+        if self.fsync == "always":
+            self._sync()
+        elif self.fsync == "batch":
+            if monotonic() - self._synced >= self.fsync_interval:
+                self._sync()
+            elif self._timer is None:
+                self._timer = asyncio.get_event_loop().call_later(
+                    self.fsync_interval, self._sync
+                )
+
+    def _sync(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self._synced = monotonic()
+
+    def _read(self, path: str, offset: int = 0) -> Iterator[Tuple[Tuple, int]]:
+        """The records of a file from offset and the offset after each of them.
+
+        A torn record at the end, from a crash during a write, ends the file.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as file:
+            file.seek(offset)
+            while True:
+                start = file.tell()
+                header = file.read(HEADER.size)
+                if not header:
+                    return
+                payload = None
+                if len(header) == HEADER.size:
+                    length, checksum = HEADER.unpack(header)
+                    payload = file.read(length)
+                    if len(payload) < length or crc32(payload) != checksum:
+                        payload = None
+                if payload is None:
+                    self.logger.error(
+                        f"<RuiaPeeweeAsync: spool {path} has a torn record "
+                        f"at {start}, skipping the rest>"
+                    )
+                    return
+                yield pickle.loads(payload), file.tell()
+
+    async def replay(
+        self,
+        apply: Callable[[Tuple], Awaitable],
+        unavailable: Callable[[BaseException], bool],
+        batch: int = 100,
+    ) -> int:
+        """Apply the spooled records in order until one fails as ``unavailable``.
+
+        A record that fails any other way is logged and dropped.
+
+        Args:
+            apply: Writes a record to its database.
+            unavailable: Whether an error means the database is still unavailable.
+            batch: The records applied between two yields to the event loop.
+
+        Returns the number of records replayed.
+        """
+        if self._replaying:
+            return 0
+        if not os.path.exists(self.replay_path):
+            self.close()
+            if not os.path.exists(self.path):
+                return 0
+            os.replace(self.path, self.replay_path)
+            self._offset = 0
+        self._replaying = True
+        try:
+            return await self._replay(apply, unavailable, batch)
+        finally:
+            self._replaying = False
+
+    async def _replay(self, apply, unavailable, batch) -> int:
+        replayed = 0
+        for record, offset in self._read(self.replay_path, self._offset):
+            try:
+                await apply(record)
+            except Exception as exc:  # pylint: disable=broad-except
+                if unavailable(exc):
+                    self.logger.warning(
+                        f"<RuiaPeeweeAsync: spool replay stopped after {replayed} "
+                        f"records: {exc}>"
+                    )
+                    return replayed
+                # Anything else fails the same way on every replay.
+                self.logger.error(
+                    f"<RuiaPeeweeAsync: dropped the spooled record {record}: {exc}>"
+                )
+            else:
+                self.replayed += 1
+                replayed += 1
+            self._offset = offset
+            self.pending -= 1
+            if replayed % batch == 0:
+                await asyncio.sleep(0)
+        os.unlink(self.replay_path)
+        self._offset = 0
+        if replayed:
+            self.logger.info(f"<RuiaPeeweeAsync: replayed {replayed} spooled records>")
+        return replayed
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
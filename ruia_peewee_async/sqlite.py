@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Optional
+
+from peewee import Model, Query, SelectBase, SqliteDatabase
+
+# WAL lets the lookups read while a write is pending, and with it NORMAL only
+# syncs at checkpoints, a power loss may lose the last commits but not corrupt the file.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+}
+
+
+def sqlite_database(path: str, pragmas: Optional[Dict] = None) -> SqliteDatabase:
+    """A SQLite database whose connection is shared with the manager's thread."""
+    return SqliteDatabase(
+        path,
+        pragmas={**DEFAULT_PRAGMAS, **(pragmas or {})},
+        thread_safe=False,
+        check_same_thread=False,
+    )
+
+
+class SqliteManager:  # pylint: disable=too-many-instance-attributes
+    """The peewee-async Manager methods the plugin uses, for a SQLite database.
+
+    The queries run one at a time on a thread of their own, the way aiosqlite does,
+    and the writes are grouped in transactions committed every ``commit_size`` writes
+    or ``commit_interval`` seconds, instead of one commit and one sync per row.
+    """
+
+    def __init__(
+        self,
+        database: SqliteDatabase,
+        commit_size: int = 1000,
+        commit_interval: float = 1.0,
+    ) -> None:
+        """
+
+        Args:
+            database: The peewee SQLite database.
+            commit_size: Commit when this many writes are pending.
+            commit_interval: Commit when the oldest pending write is older than this many seconds.
+
+        """
+
+        self.database = database
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.commits = 0
+        self._pending = 0
+        self._open = False
+        self._timer = None
+        self._closed = False
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="ruia-sqlite")
+
+    @contextmanager
+    def allow_sync(self):
+        # The SQLite database is synchronous anyway.
+        yield
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    async def _write(self, func, *args, **kwargs):
+        result = await self._run(self._in_transaction, func, *args, **kwargs)
+        if self._pending >= self.commit_size:
+            await self.commit()
+        elif self._timer is None:
+            self._timer = asyncio.ensure_future(self._commit_later())
+        return result
+
+    def _in_transaction(self, func, *args, **kwargs):
+        if not self._open:
+            self.database.connect(reuse_if_open=True)
+            self.database.begin()
+            self._open = True
+        result = func(*args, **kwargs)
+        self._pending += 1
+        return result
+
+    async def _commit_later(self):
+        await asyncio.sleep(self.commit_interval)
+        self._timer = None
+        await self.commit()
+
+    async def commit(self):
+        """Commit the pending writes."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._run(self._commit)
+
+    def _commit(self):
+        if not self._open:
+            return
+        self.database.commit()
+        self.commits += 1
+        self._pending = 0
+        self._open = False
+
+    async def execute(self, query: Query):
+        if isinstance(query, SelectBase):
+            return await self._run(lambda: list(query.execute()))
+        return await self._write(query.execute)
+
+    async def get(self, source, *args, **kwargs):
+        query = source if isinstance(source, Query) else source.select()
+        if kwargs:
+            query = query.filter(**kwargs)
+        if args:
+            query = query.where(*args)
+        return await self._run(query.get)
+
+    async def execute_sql(self, sql: str, params, insert: bool = False) -> int:
+        """Run a write statement, returns the new row id of an INSERT or the rows changed."""
+        return await self._write(self._execute_sql, sql, params, insert)
+
+    def _execute_sql(self, sql, params, insert):
+        cursor = self.database.execute_sql(sql, params)
+        return cursor.lastrowid if insert else cursor.rowcount
+
+    async def count(self, query: Query) -> int:
+        return await self._run(query.count)
+
+    async def create(self, model: Model, **data):
+        return await self._write(model.create, **data)
+
+    async def update(self, obj: Model, only=None) -> int:
+        return await self._write(obj.save, only=only)
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        await self.commit()
+        await self._run(self.database.close)
+        self._executor.shutdown()
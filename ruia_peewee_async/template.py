@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import peewee
+from peewee import Model, Query, Value
+
+from .sqlite import SqliteManager
+
+
+class _Slot:
+    """Stands for a row's value while a template is compiled."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+def _slot(name: str) -> Value:
+    # Without a converter the slot itself ends up in the query's parameters.
+    return Value(_Slot(name), converter=False)
+
+
+class SqlTemplate:
+    """A statement with a placeholder per value and the conversion of each value."""
+
+    __slots__ = ("sql", "converters", "insert", "returning")
+
+    def __init__(
+        self,
+        sql: str,
+        converters: Sequence[Tuple[str, Callable]],
+        insert: bool,
+        returning: bool,
+    ) -> None:
+        self.sql = sql
+        self.converters = converters
+        self.insert = insert
+        self.returning = returning
+
+    def params(self, values: Dict) -> List:
+        return [convert(values[name]) for name, convert in self.converters]
+
+
+def _compile(model: Model, query: Query, insert: bool) -> Optional[SqlTemplate]:
+    """The template of a query whose values are all slots.
+
+    Returns None when peewee added a value of its own, such as a callable default,
+    or returns a composite primary key.
+    """
+    sql, params = query.sql()
+    if not all(isinstance(param, _Slot) for param in params):
+        return None
+    if len(query._returning or ()) > 1:  # pylint: disable=protected-access
+        return None
+    fields = model._meta.fields  # pylint: disable=protected-access
+    return SqlTemplate(
+        sql,
+        tuple((param.name, fields[param.name].db_value) for param in params),
+        insert,
+        bool(query._returning),  # pylint: disable=protected-access
+    )
+
+
+class SqlTemplates:
+    """A bounded LRU cache of the single row INSERT and UPDATE statements.
+
+    peewee builds a query and generates its SQL for every row, while a crawl writes
+    the same columns over and over. A template is compiled once per model, operation
+    and set of columns, then every row only converts and binds its values.
+    """
+
+    def __init__(self, size: int = 256) -> None:
+        """
+
+        Args:
+            size: The maximum number of templates kept, the least recently used ones are evicted first.
+
+        """
+
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._templates: "OrderedDict[Tuple, Optional[SqlTemplate]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def _template(
+        self, key: Tuple, build: Callable[[], Optional[SqlTemplate]]
+    ) -> Optional[SqlTemplate]:
+        if key in self._templates:
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return self._templates[key]
+        self.misses += 1
+        # A query that can't be templated is remembered too, so it's compiled once.
+        template = self._templates[key] = build()
+        while len(self._templates) > self.size:
+            self._templates.popitem(last=False)
+        return template
+
+    def insert_template(self, model: Model, columns: Tuple[str, ...]):
+        fields = model._meta.fields  # pylint: disable=protected-access
+        return self._template(
+            (model, "insert", columns),
+            lambda: _compile(
+                model,
+                model.insert({fields[name]: _slot(name) for name in columns}),
+                True,
+            ),
+        )
+
+    def update_template(self, model: Model, columns: Tuple[str, ...]):
+        fields = model._meta.fields  # pylint: disable=protected-access
+        primary_key = model._meta.primary_key  # pylint: disable=protected-access
+        return self._template(
+            (model, "update", columns),
+            lambda: _compile(
+                model,
+                model.update({fields[name]: _slot(name) for name in columns}).where(
+                    primary_key == _slot(primary_key.name)
+                ),
+                False,
+            ),
+        )
+
+    async def create(self, manager, model: Model, data: Dict):
+        """``manager.create(model, **data)`` through the template of its columns."""
+        inst = model(**data)
+        values = inst.__data__
+        template = self.insert_template(model, tuple(sorted(values)))
+        if template is None:
+            return await manager.create(model, **data)
+        primary_key = await _execute(manager, template, template.params(values))
+        if inst._pk is None:  # pylint: disable=protected-access
+            inst._pk = primary_key  # pylint: disable=protected-access
+        return inst
+
+    async def update(self, manager, obj: Model, only=None) -> int:
+        """``manager.update(obj, only)`` through the template of its columns."""
+        meta = obj._meta  # pylint: disable=protected-access
+        if meta.composite_key:
+            return await manager.update(obj, only=only)
+        values = dict(obj.__data__)
+        names = None
+        if only:
+            names = {name if isinstance(name, str) else name.name for name in only}
+        if meta.only_save_dirty:
+            dirty = {field.name for field in obj.dirty_fields}
+            names = dirty if names is None else names & dirty
+        primary_key = meta.primary_key.name
+        columns = tuple(
+            sorted(
+                name
+                for name in values
+                if name != primary_key and (names is None or name in names)
+            )
+        )
+        template = self.update_template(type(obj), columns) if columns else None
+        if template is None:
+            return await manager.update(obj, only=only)
+        values[primary_key] = obj._pk  # pylint: disable=protected-access
+        rows = await _execute(manager, template, template.params(values))
+        obj._dirty.clear()  # pylint: disable=protected-access
+        return rows
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+async def _execute(manager, template: SqlTemplate, params: List):
+    """Run a template the way peewee-async runs its query.
+
+    Returns the new primary key of an INSERT and the updated rows of an UPDATE.
+    """
+    if isinstance(manager, SqliteManager):
+        return await manager.execute_sql(template.sql, params, template.insert)
+    database = manager.database
+    with peewee.__exception_wrapper__:
+        cursor = await database.cursor_async()
+        try:
+            await cursor.execute(template.sql, params)
+            if not template.insert:
+                return cursor.rowcount
+            if template.returning:
+                row = await cursor.fetchone()
+                return row[0] if row is not None else None
+            return await database.last_insert_id_async(cursor)
+        finally:
+            await cursor.release()
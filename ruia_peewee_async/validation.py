@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from typing import Callable, Dict, Tuple
+
+from peewee import Query
+from schema import Schema, SchemaError, Use
+
+from .spider import Spider, TargetDB
+
+
+def _raise_no_attr(target, fields, pre_msg):
+    for field in fields:
+        if hasattr(target, field):
+            continue
+        raise SchemaError(
+            f"<{pre_msg} error: callback_result should have {field} attribute>"
+        )
+
+
+def _check_result(data: Tuple):
+    target, type_dict, pre_msg = data
+    type_dict: Dict
+    _compile_checker(type_dict, pre_msg)(target)
+
+
+result_validator = Schema(Use(_check_result))
+
+INSERT_RESULT_TYPES = {
+    "data": dict,
+    "database": TargetDB,
+    "filters": (str, type(None), list),
+}
+UPDATE_RESULT_TYPES = {
+    "data": dict,
+    "database": TargetDB,
+    "query": (Query, dict),
+    "filters": (str, type(None), list),
+    "create_when_not_exists": bool,
+    "not_update_when_exists": bool,
+    "only": (list, tuple, type(None)),
+}
+_result_checkers: Dict[Tuple[type, str], Callable] = {}
+
+
+def _compile_checker(type_dict: Dict, pre_msg: str) -> Callable:
+    """Build a checker of the ``type_dict`` attributes with every error message prepared once."""
+    names = tuple(type_dict)
+    checks = tuple(
+        (
+            name,
+            vtype,
+            name in ("data", "query"),
+            f"<{pre_msg} error: {name} cannot be empty>",
+            f"<{pre_msg} error: callback_result's {name} should be a {vtype}>",
+        )
+        for name, vtype in type_dict.items()
+    )
+
+    def check(target):
+        for name in names:
+            if not hasattr(target, name):
+                _raise_no_attr(target, names, pre_msg)
+        for name, vtype, required, empty_msg, type_msg in checks:
+            attr = getattr(target, name)
+            if required and not attr:
+                raise SchemaError(empty_msg)
+            if not isinstance(attr, vtype):
+                raise SchemaError(type_msg)
+
+    return check
+
+
+def _validate_result(spider_ins: Spider, callback_result, type_dict: Dict, pre_msg):
+    """Validate a callback result as the ``validation`` option's policy says.
+
+    The checkers are compiled once per result class. In the ``sampled`` mode only the
+    first ``first`` results and then one result out of ``every`` are checked.
+    """
+    validation_config = getattr(spider_ins, "validation_config", None) or {}
+    mode = validation_config.get("mode", "full")
+    if mode == "off":
+        return
+    if mode == "sampled":
+        seen = getattr(spider_ins, "validated_results", 0)
+        spider_ins.validated_results = seen + 1
+        first = validation_config.get("first", 100)
+        if seen >= first and (seen - first) % validation_config.get("every", 100):
+            return
+    key = (type(callback_result), pre_msg)
+    checker = _result_checkers.get(key)
+    if checker is None:
+        checker = _result_checkers[key] = _compile_checker(type_dict, pre_msg)
+    checker(callback_result)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List
+
+
+class WriteQueue:  # pylint: disable=too-many-instance-attributes
+    """A bounded queue of database writes consumed by a pool of writer tasks.
+
+    Callbacks only enqueue their writes, they wait only while the queue is full,
+    so a slow database throttles the crawl instead of stalling every worker on a query.
+    """
+
+    def __init__(self, logger, size: int = 1000, workers: int = 1) -> None:
+        """
+
+        Args:
+            logger: The spider's logger.
+            size: The maximum number of pending writes, callbacks wait when it's reached.
+            workers: The number of writer tasks, usually the size of the connection pool.
+
+        """
+
+        self.logger = logger
+        self.size = size
+        self.workers = workers
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.overflowed = 0
+        self._busy_time = 0.0
+        self._started = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._started = perf_counter()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    def wrap(
+        self, func: Callable[..., Awaitable], overflow: Callable[..., None] = None
+    ) -> Callable[..., Awaitable]:
+        """Turn a write coroutine function into one that only enqueues the write.
+
+        With ``overflow``, a write that finds the queue full is passed to it instead of waiting.
+        """
+
+        async def enqueue(*args):
+            if overflow is not None and self._queue.full():
+                self.overflowed += 1
+                overflow(*args)
+                return
+            await self._queue.put((func, args))
+
+        return enqueue
+
+    async def _work(self):
+        while True:
+            func, args = await self._queue.get()
+            self.busy += 1
+            start = perf_counter()
+            try:
+                await func(*args)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.failed += 1
+                self.logger.error(f"<RuiaPeeweeAsync: write queue error: {exc}>")
+            finally:
+                self._busy_time += perf_counter() - start
+                self.busy -= 1
+                self.processed += 1
+                self._queue.task_done()
+
+    async def join(self):
+        """Wait for the pending writes, then stop the writer tasks."""
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict:
+        elapsed = perf_counter() - self._started if self._started else 0.0
+        return {
+            "depth": self._queue.qsize(),
+            "size": self.size,
+            "workers": self.workers,
+            "busy": self.busy,
+            "processed": self.processed,
+            "failed": self.failed,
+            "overflowed": self.overflowed,
+            "utilization": self._busy_time / (elapsed * self.workers)
+            if elapsed
+            else 0.0,
+        }
@@ -127,3 +127,8 @@ def postgresql(docker_ip, docker_services):
         lambda: check_postgres(postgres_conf), 300, 10
     )
     return postgres_conf
+
+
+@pytest.fixture(scope="function")
+def sqlite(tmp_path):
+    return {"database": str(tmp_path / "ruia.db")}
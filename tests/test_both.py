@@ -5,7 +5,13 @@ from random import randint
 import pytest
 from peewee import CharField
 
-from ruia_peewee_async import TargetDB, after_start, create_model, before_stop
+from ruia_peewee_async import (
+    RuiaPeeweeInsert,
+    TargetDB,
+    after_start,
+    create_model,
+    before_stop,
+)
 
 from .common import Insert, Update
 
@@ -16,6 +22,14 @@ class BothInsert(Insert):
             yield item
 
 
+class BackendsInsert(Insert):
+    async def parse(self, response):
+        async for result in super().parse(response):
+            yield RuiaPeeweeInsert(
+                result.data, backends=["mysql", "mysql_b", "postgres_b"]
+            )
+
+
 class BothUpdate(Update):
     async def parse(self, response):
         async for item in super().parse(response):
@@ -251,3 +265,55 @@ class TestBoth:
         )
         assert "RuntimeError" not in caplog.text
         assert "Exception" not in caplog.text
+
+    @pytest.mark.dependency(depends=["TestBoth::test_both_before_stop"])
+    async def test_both_error_isolation(
+        self, mysql, postgresql, event_loop, caplog
+    ):  # pylint: disable=protected-access
+        mysql, postgresql = basic_setup(mysql, postgresql)
+        mysql["model"]["table_name"] = "ruia_mysql_isolation"
+        postgresql["model"]["table_name"] = "ruia_postgres_isolation"
+        mmodel, _ = create_model(create_table=True, mysql=mysql)
+        # MySQL raises an OperationalError for the unknown url column.
+        columns = mmodel._meta.database.get_columns("ruia_mysql_isolation")
+        if "url" in [column.name for column in columns]:
+            mmodel._meta.database.execute_sql(
+                "ALTER TABLE ruia_mysql_isolation DROP COLUMN url"
+            )
+        spider_ins = await BothInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, postgres=postgresql),
+            target_db=TargetDB.BOTH,
+        )
+        assert "MYSQL insert data" in caplog.text
+        assert "into database: ['POSTGRES']" in caplog.text
+        prows = await spider_ins.postgres_manager.count(
+            spider_ins.postgres_model.select()
+        )
+        assert prows >= 10
+
+    @pytest.mark.dependency(depends=["TestBoth::test_both_before_stop"])
+    async def test_both_named_backends(self, mysql, postgresql, event_loop):
+        mysql, postgresql = basic_setup(mysql, postgresql)
+        mysql["model"]["table_name"] = "ruia_mysql_backend_a"
+        mysql_b = {
+            **mysql,
+            "type": "mysql",
+            "model": {**mysql["model"], "table_name": "ruia_mysql_backend_b"},
+        }
+        postgres_b = {
+            **postgresql,
+            "type": "postgres",
+            "model": {**postgresql["model"], "table_name": "ruia_postgres_backend_b"},
+        }
+        spider_ins = await BackendsInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                mysql=mysql, backends={"mysql_b": mysql_b, "postgres_b": postgres_b}
+            ),
+            before_stop=before_stop,
+        )
+        assert set(spider_ins.backends) == {"mysql", "mysql_b", "postgres_b"}
+        for backend in spider_ins.backends.values():
+            with backend.manager.allow_sync():
+                assert backend.model.select().count() == 10
@@ -1,15 +1,42 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import logging
 import ssl
 from copy import deepcopy
 from contextlib import contextmanager
+from datetime import date
+from time import sleep
 
+import peewee
+import psycopg2
+import pymysql
 import pytest
 from peewee import ModelBase
 from peewee_async import PooledMySQLDatabase, PooledPostgresqlDatabase
 from schema import SchemaError, SchemaMissingKeyError
 
-from ruia_peewee_async import after_start, create_model
+from ruia_peewee_async import (
+    INSERT_RESULT_TYPES,
+    BloomFilter,
+    Metrics,
+    Report,
+    SummaryReporter,
+    _replica,
+    _validate_result,
+    after_start,
+    shard_of,
+    create_model,
+)
+from ruia_peewee_async.retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    is_transient,
+)
+from ruia_peewee_async.buffer import CopyBuffer, _csv_value
+from ruia_peewee_async.profile import NO_STAGE, StageProfiler
+from ruia_peewee_async.template import SqlTemplates
 
 from .common import Insert, RuiaPeeweeInsert, RuiaPeeweeUpdate, TargetDB, Update
 
@@ -240,6 +267,412 @@ class TestConfig:
             )
         assert "Key 'model' error:\nMissing key: 'table_name'" in se4.value.args[0]
 
+    async def test_options_config(
+        self, docker_setup, docker_cleanup, event_loop, mysql_config
+    ):  # pylint: disable=redefined-outer-name,unused-argument,unknown-option-value
+        with pytest.raises(SchemaError) as se1:
+            await Insert.async_start(
+                loop=event_loop,
+                after_start=after_start(mysql=mysql_config, batch={"size": 0}),
+            )
+        assert "Key 'batch' error" in se1.value.args[0]
+        with pytest.raises(SchemaError) as se2:
+            await Insert.async_start(
+                loop=event_loop,
+                after_start=after_start(
+                    mysql=mysql_config, batch={"max_latency": "1s"}
+                ),
+            )
+        assert "Key 'batch' error" in se2.value.args[0]
+        with not_raises(SchemaError):
+            after_start(mysql=mysql_config, batch={"size": 500, "max_latency": 0.5})
+        with pytest.raises(SchemaError) as se3:
+            after_start(mysql=mysql_config, filter_cache={"ttl": -1})
+        assert "Key 'filter_cache' error" in se3.value.args[0]
+        with not_raises(SchemaError):
+            after_start(mysql=mysql_config, filter_cache={"size": 1000, "ttl": 60})
+        with pytest.raises(SchemaError) as se4:
+            after_start(mysql=mysql_config, bloom={"error_rate": 0.01})
+        assert "Missing key: 'filters'" in se4.value.args[0]
+        with not_raises(SchemaError):
+            after_start(
+                mysql=mysql_config, bloom={"filters": ["url"], "error_rate": 0.001}
+            )
+
+    async def test_bulk_load_config(self, mysql_config, postgres_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(postgres=postgres_config, copy={"size": -1})
+        assert "Key 'copy' error" in se1.value.args[0]
+        with not_raises(SchemaError):
+            after_start(postgres=postgres_config, copy={"size": 5000, "max_latency": 2})
+        with pytest.raises(SchemaError) as se2:
+            after_start(mysql=mysql_config, load_data={"max_latency": 0})
+        assert "Key 'load_data' error" in se2.value.args[0]
+        assert [_csv_value(value, "NULL") for value in (True, None, b"\x00a")] == [
+            '"1"',
+            "NULL",
+            '"0061"',
+        ]
+
+    async def test_copy_connection(self, postgres_config, monkeypatch):
+        postgres_config["model"]["some_blob"] = peewee.BlobField(null=True)
+        model, manager = create_model(postgres=postgres_config)
+        connections = []
+
+        class Connection:
+            closed = False
+
+            def __init__(self, **params):
+                self.params = params
+                self.copied = []
+                connections.append(self)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def cursor(self):
+                return self
+
+            def copy_expert(self, _sql, stream):
+                self.copied.append(stream.getvalue())
+
+            def close(self):
+                self.closed = True
+
+        monkeypatch.setattr(psycopg2, "connect", Connection)
+        buffer = CopyBuffer(manager, model, "POSTGRES", logging.getLogger(__name__))
+        row = {"some_date": date(2022, 1, 2), "some_char": "a", "some_blob": b"\x01"}
+        for _ in range(2):
+            await buffer._write([row])  # pylint: disable=protected-access
+        await buffer.close()
+        assert len(connections) == 1
+        assert connections[0].params["host"] == "somehost"
+        assert connections[0].copied[0] == '"2022-01-02","a","\\x01"\n'
+        assert connections[0].closed
+        assert manager.database._allow_sync  # pylint: disable=protected-access
+
+    async def test_write_queue_config(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, write_queue={"workers": 0})
+        assert "Key 'write_queue' error" in se1.value.args[0]
+        with not_raises(SchemaError):
+            after_start(mysql=mysql_config, write_queue={"size": 1000, "workers": 4})
+
+    async def test_filter_batch_config(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, filter_batch={"window": -1})
+        assert "Key 'filter_batch' error" in se1.value.args[0]
+        with not_raises(SchemaError):
+            after_start(mysql=mysql_config, filter_batch={"window": 0.01, "size": 50})
+
+    async def test_upsert_query(self, mysql_config, postgres_config):
+        mysql_model, _, postgres_model, _ = create_model(
+            mysql=mysql_config, postgres=postgres_config
+        )
+        data, query = {"some_date": "2023-01-01", "some_char": "x"}, {"some_char": "x"}
+        sql, _ = RuiaPeeweeUpdate._upsert_query(  # pylint: disable=protected-access
+            mysql_model, data, query, True, True, None
+        ).sql()
+        assert sql.startswith("INSERT IGNORE INTO")
+        sql, _ = RuiaPeeweeUpdate._upsert_query(  # pylint: disable=protected-access
+            mysql_model, data, query, True, False, None
+        ).sql()
+        assert sql.endswith("ON DUPLICATE KEY UPDATE `some_date` = VALUES(`some_date`)")
+        sql, _ = RuiaPeeweeUpdate._upsert_query(  # pylint: disable=protected-access
+            postgres_model, data, query, True, False, ["some_date"]
+        ).sql()
+        assert (
+            'ON CONFLICT ("some_char") DO UPDATE SET "some_date" = EXCLUDED."some_date"'
+            in sql
+        )
+        sql, _ = RuiaPeeweeUpdate._upsert_query(  # pylint: disable=protected-access
+            postgres_model, data, query, False, False, None
+        ).sql()
+        assert sql.startswith('UPDATE "test" SET "some_date" = %s WHERE')
+        assert (
+            RuiaPeeweeUpdate._upsert_query(  # pylint: disable=protected-access
+                postgres_model, data, query, False, True, None
+            )
+            is None
+        )
+
+    async def test_bloom_filter(self, mysql_config):
+        bloom = BloomFilter(["url", "title"], capacity=1000, error_rate=0.01)
+        for num in range(1000):
+            bloom.add({"url": f"http://{num}.com", "title": str(num)})
+        assert all(
+            {"title": str(num), "url": f"http://{num}.com"} in bloom
+            for num in range(1000)
+        )
+        false_positives = sum(
+            {"url": f"http://{num}.com", "title": str(num)} in bloom
+            for num in range(1000, 11000)
+        )
+        assert false_positives < 200
+        assert bloom.accepts(["title", "url"]) is True
+        assert bloom.accepts(["url"]) is False
+        model, _ = create_model(mysql=mysql_config)
+        bloom = BloomFilter(["some_date"], capacity=1000, model=model)
+        bloom.add({"some_date": date(2022, 1, 2)})
+        assert {"some_date": "2022-01-02"} in bloom
+
+    async def test_metrics(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, metrics={"buckets": []})
+        assert "Key 'metrics' error" in se1.value.args[0]
+        metrics = Metrics(buckets=[0.01, 0.1])
+        metrics.observe("mysql", "create", 0.005)
+        metrics.observe("mysql", "create", 0.05, rows=3)
+        with pytest.raises(ValueError):
+            with metrics.timer("mysql", "update"):
+                raise ValueError()
+        with pytest.raises(KeyError):
+            with metrics.timer("mysql", "get", expected=KeyError):
+                raise KeyError()
+        snapshot = metrics.snapshot()
+        assert snapshot[("mysql", "create")]["rows"] == 4
+        assert snapshot[("mysql", "update")]["errors"] == 1
+        assert snapshot[("mysql", "get")]["errors"] == 0
+        text = metrics.prometheus()
+        labels = 'database="mysql",operation="create"'
+        assert f"ruia_peewee_async_operations_total{{{labels}}} 2" in text
+        assert (
+            f'ruia_peewee_async_latency_seconds_bucket{{{labels},le="0.01"}} 1' in text
+        )
+        assert (
+            f'ruia_peewee_async_latency_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+        )
+
+    async def test_validation_policy(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, validation={"mode": "never"})
+        assert "Key 'validation' error" in se1.value.args[0]
+        spider_ins = Insert()
+        spider_ins.validation_config = {"mode": "sampled", "first": 2, "every": 3}
+        checked = []
+        for num in range(9):
+            try:
+                _validate_result(  # pylint: disable=protected-access
+                    spider_ins,
+                    RuiaPeeweeInsert("not a dict"),
+                    INSERT_RESULT_TYPES,
+                    "RuiaPeeweeAsync: insert process",
+                )
+            except SchemaError:
+                checked.append(num)
+        assert checked == [0, 1, 2, 5, 8]
+        spider_ins.validation_config = {"mode": "off"}
+        _validate_result(  # pylint: disable=protected-access
+            spider_ins,
+            RuiaPeeweeInsert("not a dict"),
+            INSERT_RESULT_TYPES,
+            "RuiaPeeweeAsync: insert process",
+        )
+
+    async def test_backends_config(self, mysql_config, postgres_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, backends={"shard": mysql_config})
+        assert "Key 'backends' error" in se1.value.args[0]
+        with pytest.raises(SchemaError) as se2:
+            after_start(
+                mysql=mysql_config,
+                backends={"postgres": {**postgres_config, "type": "postgres"}},
+            )
+        assert "Key 'backends' error" in se2.value.args[0]
+        with pytest.raises(SchemaError) as se3:
+            after_start(
+                mysql=mysql_config,
+                backends={
+                    "SQLite": {
+                        "type": "sqlite",
+                        "database": ":memory:",
+                        "model": {"table_name": "ruia_sqlite"},
+                    }
+                },
+            )
+        assert "Key 'backends' error" in se3.value.args[0]
+        with pytest.raises(SchemaError) as se4:
+            after_start(
+                mysql=mysql_config,
+                backends={"mysql_1": {**mysql_config, "type": "mysql"}},
+                sharding={"key": "url", "tables": 2},
+            )
+        assert "Key 'backends' error" in se4.value.args[0]
+        with not_raises(SchemaError):
+            after_start(
+                mysql=mysql_config,
+                backends={"shard_b": {**mysql_config, "type": "mysql"}},
+            )
+        with not_raises(SchemaError):
+            after_start(
+                mysql=mysql_config,
+                backends={"mysql_1": {**mysql_config, "type": "mysql"}},
+            )
+        insert = RuiaPeeweeInsert({"url": "x"}, backends="shard_b")
+        assert insert.databases == ("SHARD_B",)
+
+    async def test_sharding_config(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, sharding={"key": "url", "tables": 1})
+        assert "Key 'sharding' error" in se1.value.args[0]
+        with pytest.raises(SchemaError) as se2:
+            after_start(
+                mysql=mysql_config,
+                sharding={"key": "url", "tables": 2, "backends": ["a", "b"]},
+            )
+        assert "Key 'sharding' error" in se2.value.args[0]
+        with not_raises(SchemaError):
+            after_start(mysql=mysql_config, sharding={"key": "url", "tables": 4})
+        assert shard_of("http://testing.com", 4) == shard_of("http://testing.com", 4)
+        shards = [shard_of(f"http://testing.com/{i}", 4) for i in range(1000)]
+        assert all(200 < shards.count(shard) < 300 for shard in range(4))
+
+    async def test_replica_config(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql={**mysql_config, "replica": {"fallback": "yes"}})
+        assert "Key 'replica' error" in se1.value.args[0]
+        replica = {"host": "replica", "fallback": False}
+        with not_raises(SchemaError):
+            after_start(mysql={**mysql_config, "replica": replica})
+        manager, fallback = _replica("mysql", {**mysql_config, "replica": replica})
+        assert manager.database.connect_params["host"] == "replica"
+        assert manager.database.connect_params["port"] == 1234
+        assert fallback is False
+        assert _replica("mysql", mysql_config) == (None, True)
+
+    async def test_retry_config(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, retry={"attempts": 0})
+        assert "Key 'retry' error" in se1.value.args[0]
+        with pytest.raises(SchemaError) as se2:
+            after_start(mysql=mysql_config, circuit_breaker={"reset": -1})
+        assert "Key 'circuit_breaker' error" in se2.value.args[0]
+        with not_raises(SchemaError):
+            after_start(
+                mysql=mysql_config,
+                retry={"attempts": 5, "base": 0.1, "cap": 1},
+                circuit_breaker={"threshold": 3, "reset": 10},
+            )
+        lock_wait = pymysql.OperationalError(1205, "Lock wait timeout exceeded")
+        assert is_transient(lock_wait)
+        assert is_transient(peewee.OperationalError(lock_wait, *lock_wait.args))
+        unknown_column = pymysql.OperationalError(1054, "Unknown column")
+        assert not is_transient(unknown_column)
+        assert not is_transient(
+            peewee.OperationalError(unknown_column, *unknown_column.args)
+        )
+        policy = RetryPolicy(attempts=5, base=0.1, cap=0.5)
+        assert all(0 <= policy.backoff(attempt) <= 0.5 for attempt in range(10))
+        breaker = CircuitBreaker(
+            "mysql", logging.getLogger(__name__), threshold=2, reset=0.01
+        )
+        breaker.failure()
+        breaker.check()
+        breaker.failure()
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+        await asyncio.sleep(0.02)
+        breaker.check()
+        # Only one trial call goes through while half-open.
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+        breaker.success()
+        assert breaker.state == "closed"
+        assert breaker.opened == 1
+
+    async def test_sql_templates(self, mysql_config, postgres_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, sql_templates={"size": 0})
+        assert "Key 'sql_templates' error" in se1.value.args[0]
+        templates = SqlTemplates(size=3)
+        data = {"some_date": date(2022, 1, 2), "some_char": "a"}
+        for config in ({"mysql": mysql_config}, {"postgres": postgres_config}):
+            model, _ = create_model(**config)
+            insert = templates.insert_template(model, tuple(sorted(data)))
+            assert (insert.sql, insert.params(data)) == model.insert(**data).sql()
+            update = templates.update_template(model, ("some_char",))
+            query = model.update(some_char="a").where(model.id == 1)
+            assert (update.sql, update.params({"some_char": "a", "id": 1})) == (
+                query.sql()
+            )
+            assert templates.insert_template(model, tuple(sorted(data))) is insert
+        assert insert.returning
+        assert templates.stats() == {
+            "size": 3,
+            "hits": 2,
+            "misses": 4,
+            "hit_rate": 2 / 6,
+        }
+
+    async def test_profile_config(self, mysql_config):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, profile={"mode": "perf"})
+        assert "Key 'profile' error" in se1.value.args[0]
+        with pytest.raises(SchemaError):
+            after_start(mysql=mysql_config, profile={"signal": "SIGNOPE"})
+        with pytest.raises(SchemaError):
+            after_start(mysql=mysql_config, profile={"hooks": ["not callable"]})
+        logger = logging.getLogger("ruia_peewee_async.tests")
+        profiler = StageProfiler(logger, timer=False)
+        assert profiler.stage("item") is NO_STAGE
+        profiler = StageProfiler(logger, mode="sampling", interval=0.0005, top=5)
+        profiler.profile(items=2)
+        assert profiler.runs == 1
+        for _ in range(2):
+            with profiler.stage("write", "mysql"):
+                sleep(0.01)
+            profiler.item_done()
+        assert profiler._profiler is None  # pylint: disable=protected-access
+        assert profiler.stats()["write"]["count"] == 2
+        assert profiler.stats()["write"]["max"] >= 0.01
+
+    async def test_pool_bounds_config(self, mysql_config):
+        with pytest.raises(SchemaError):
+            after_start(
+                mysql={**mysql_config, "min_connections": 20, "max_connections": 10}
+            )
+        with pytest.raises(SchemaError) as se2:
+            after_start(mysql=mysql_config, adaptive_pool={"wait": 0})
+        assert "Key 'adaptive_pool' error" in se2.value.args[0]
+        with not_raises(SchemaError):
+            after_start(
+                mysql={**mysql_config, "min_connections": 2, "max_connections": 200},
+                adaptive_pool={"interval": 1, "wait": 0.01},
+            )
+
+    async def test_result_normalization(self):
+        insert = RuiaPeeweeInsert({"url": "x"}, TargetDB.BOTH, filters="url")
+        assert not hasattr(insert, "__dict__")
+        assert insert.databases == ("MYSQL", "POSTGRES")
+        assert insert.filters == ["url"]
+        update = RuiaPeeweeUpdate(
+            {"url": "x"}, {"url": "x"}, TargetDB.POSTGRES, only=["url"]
+        )
+        assert not hasattr(update, "__dict__")
+        assert update.databases == ("POSTGRES",)
+        assert update.only == ("url",)
+        assert RuiaPeeweeInsert({"url": "x"}, "mongo").databases == ()
+
+    async def test_summary_report(self, mysql_config, caplog):
+        with pytest.raises(SchemaError) as se1:
+            after_start(mysql=mysql_config, summary={"interval": 0})
+        assert "Key 'summary' error" in se1.value.args[0]
+        report = (
+            Report().count("mysql", "inserted").add("<{} into {}>", {"a": 1}, "MYSQL")
+        )
+        assert str(report) == "<{'a': 1} into MYSQL>"
+        reporter = SummaryReporter(logging.getLogger("summary"), interval=3600)
+        with caplog.at_level(logging.INFO):
+            reporter.record(report)
+            reporter.record(Report().count("mysql", "filtered"))
+            reporter.error("postgres")
+            assert "into MYSQL" not in caplog.text
+            reporter.flush()
+        assert "MYSQL filtered=1 inserted=1; POSTGRES failed=1" in caplog.text
+
     async def test_pool_config(
         self,
         docker_setup,
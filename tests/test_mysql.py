@@ -177,3 +177,210 @@ class TestMySQL:
         )
         assert "RuntimeError" not in caplog.text
         assert "Exception" not in caplog.text
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_before_stop"])
+    async def test_mysql_batch_insert(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        model, _ = create_model(create_table=True, mysql=mysql)
+        model.truncate_table()
+        await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, batch={"size": 4, "max_latency": 60}),
+            before_stop=before_stop,
+        )
+        assert "Success batch insert 4 rows into MYSQL" in caplog.text
+        assert "Success batch insert 2 rows into MYSQL" in caplog.text
+        assert model.select().count() == 10
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_load_data(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        mysql["model"]["table_name"] = "ruia_mysql_load"
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, load_data={"size": 4}),
+            before_stop=before_stop,
+        )
+        assert "Success batch load 4 rows into MYSQL" in caplog.text
+        assert "Success batch load 2 rows into MYSQL" in caplog.text
+        count = await spider_ins.mysql_manager.count(spider_ins.mysql_model.select())
+        assert count == 10
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_write_queue(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        mysql["model"]["table_name"] = "ruia_mysql_queue"
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, write_queue={"size": 2}),
+            before_stop=before_stop,
+        )
+        stats = spider_ins.write_queue.stats()
+        assert stats["depth"] == 0
+        assert stats["processed"] == 10
+        assert stats["failed"] == 0
+        assert "write queue:" in caplog.text
+        assert spider_ins.metrics.snapshot()[("mysql", "create")]["count"] == 10
+        count = await spider_ins.mysql_manager.count(spider_ins.mysql_model.select())
+        assert count == 10
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_summary(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, summary={"interval": 3600}),
+            filters="url",
+            before_stop=before_stop,
+        )
+        assert "was filtered by filters" not in caplog.text
+        assert "MYSQL filtered=10" in caplog.text
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_sharding(self, mysql, event_loop):
+        mysql = basic_setup(mysql)
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, sharding={"key": "url", "tables": 3}),
+            filters="url",
+        )
+        rows = 0
+        for shard in range(3):
+            backend = spider_ins.backends[f"mysql_{shard}"]
+            meta = backend.model._meta  # pylint: disable=protected-access
+            assert meta.table_name == f"ruia_mysql_{shard}"
+            rows += await backend.manager.count(backend.model.select())
+        assert rows == 10
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_replica(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql={**mysql, "replica": {"port": 1}}),
+            filters="url",
+        )
+        assert spider_ins.backends["mysql"].replica is not None
+        assert "MYSQL replica read error" in caplog.text
+        assert "was filtered by filters" in caplog.text
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_adaptive_pool(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                mysql={
+                    **mysql,
+                    "pool": True,
+                    "min_connections": 1,
+                    "max_connections": 50,
+                },
+                adaptive_pool={"interval": 0.01, "wait": 0.0001},
+            ),
+            filters="url",
+            before_stop=before_stop,
+        )
+        stats = spider_ins.pools["mysql"].stats()
+        assert stats["acquires"] >= 10
+        assert 1 <= stats["maxsize"] <= 50
+        assert "MYSQL connection pool: " in caplog.text
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_batch_insert"])
+    async def test_mysql_filter_cache(self, mysql, event_loop):
+        mysql = basic_setup(mysql)
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, filter_cache={"size": 100}),
+            filters="url",
+            yield_origin=False,
+        )
+        cache = spider_ins.filter_caches[("mysql", spider_ins.mysql_model)]
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["hits"] == 9
+        rows = await spider_ins.mysql_manager.count(
+            spider_ins.mysql_model.select().where(
+                spider_ins.mysql_model.url == "http://testinginsert.com"
+            )
+        )
+        assert rows == 1
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_filter_cache"])
+    async def test_mysql_bloom_filter(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                mysql=mysql, bloom={"filters": "url", "chunk_size": 3}
+            ),
+            filters="url",
+        )
+        assert "MYSQL bloom filter prewarmed with 11 keys" in caplog.text
+        bloom = spider_ins.bloom_filters[("mysql", spider_ins.mysql_model)]
+        assert {"url": "http://testinginsert.com"} in bloom
+        rows = await spider_ins.mysql_manager.count(spider_ins.mysql_model.select())
+        assert rows == 11
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_bloom_filter"])
+    async def test_mysql_filter_batch(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        spider_ins = await MySQLInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                mysql=mysql, filter_batch={"window": 0.05, "size": 100}
+            ),
+            filters=["url", "title"],
+        )
+        assert "was filtered by filters" in caplog.text
+        lookup = spider_ins.filter_lookups[
+            ("mysql", spider_ins.mysql_model, ("url", "title"))
+        ]
+        assert lookup.lookups == 10
+        assert lookup.queries <= lookup.lookups
+        rows = await spider_ins.mysql_manager.count(spider_ins.mysql_model.select())
+        assert rows == 11
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_before_stop"])
+    async def test_mysql_upsert(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        mysql["model"].update(
+            {"table_name": "ruia_mysql_upsert", "title": CharField(unique=True)}
+        )
+        await MySQLUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, upsert=True),
+            yield_origin=True,
+        )
+        spider_ins = await MySQLUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, upsert=True),
+            not_update_when_exists=False,
+        )
+        assert "Upserted" in caplog.text
+        rows = await spider_ins.mysql_manager.count(spider_ins.mysql_model.select())
+        assert rows == 10
+        urls = await spider_ins.mysql_manager.count(
+            spider_ins.mysql_model.select().where(
+                spider_ins.mysql_model.url == "http://testing.com"
+            )
+        )
+        assert urls == 10
+
+    @pytest.mark.dependency(depends=["TestMySQL::test_mysql_upsert"])
+    async def test_mysql_update_batch(self, mysql, event_loop, caplog):
+        mysql = basic_setup(mysql)
+        mysql["model"].update(
+            {"table_name": "ruia_mysql_upsert", "title": CharField(unique=True)}
+        )
+        model, _ = create_model(create_table=True, mysql=mysql)
+        model.update(url="http://before.com").execute()
+        await MySQLUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(mysql=mysql, update_batch={"size": 4}),
+            not_update_when_exists=False,
+            create_when_not_exists=False,
+            before_stop=before_stop,
+        )
+        assert "Success batch update 4 rows into MYSQL" in caplog.text
+        assert "Success batch update 2 rows into MYSQL" in caplog.text
+        assert model.select().where(model.url == "http://testing.com").count() == 10
@@ -203,3 +203,92 @@ class TestPostgreSQL:
         )
         assert "RuntimeError" not in caplog.text
         assert "Exception" not in caplog.text
+
+    @pytest.mark.dependency(depends=["TestPostgreSQL::test_postgres_before_stop"])
+    async def test_postgres_upsert(self, postgresql, event_loop, caplog):
+        postgresql = basic_setup(postgresql)
+        postgresql["model"].update(
+            {"table_name": "ruia_postgres_upsert", "title": CharField(unique=True)}
+        )
+        await PostgresqlUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(postgres=postgresql, upsert=True),
+            target_db=TargetDB.POSTGRES,
+            yield_origin=True,
+        )
+        spider_ins = await PostgresqlUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(postgres=postgresql, upsert=True),
+            target_db=TargetDB.POSTGRES,
+            not_update_when_exists=False,
+        )
+        assert "Upserted" in caplog.text
+        rows = await spider_ins.postgres_manager.count(
+            spider_ins.postgres_model.select()
+        )
+        assert rows == 10
+        urls = await spider_ins.postgres_manager.count(
+            spider_ins.postgres_model.select().where(
+                spider_ins.postgres_model.url == "http://testing.com"
+            )
+        )
+        assert urls == 10
+
+    @pytest.mark.dependency(depends=["TestPostgreSQL::test_postgres_upsert"])
+    async def test_postgres_update_batch(self, postgresql, event_loop, caplog):
+        postgresql = basic_setup(postgresql)
+        postgresql["model"].update(
+            {"table_name": "ruia_postgres_upsert", "title": CharField(unique=True)}
+        )
+        model, _ = create_model(create_table=True, postgres=postgresql)
+        model.update(url="http://before.com").execute()
+        await PostgresqlUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(postgres=postgresql, update_batch={"size": 4}),
+            target_db=TargetDB.POSTGRES,
+            not_update_when_exists=False,
+            create_when_not_exists=False,
+            before_stop=before_stop,
+        )
+        assert "Success batch update 4 rows into POSTGRES" in caplog.text
+        assert "Success batch update 2 rows into POSTGRES" in caplog.text
+        assert model.select().where(model.url == "http://testing.com").count() == 10
+        model.update(url="http://before.com").execute()
+        await PostgresqlUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(postgres=postgresql, update_batch={"size": 20}),
+            target_db=TargetDB.POSTGRES,
+            not_update_when_exists=False,
+            before_stop=before_stop,
+        )
+        assert model.select().count() == 10
+        assert model.select().where(model.url == "http://testing.com").count() == 10
+
+    @pytest.mark.dependency(depends=["TestPostgreSQL::test_postgres_before_stop"])
+    async def test_postgres_copy(self, postgresql, event_loop, caplog):
+        postgresql = basic_setup(postgresql)
+        postgresql["model"]["table_name"] = "ruia_postgres_copy"
+        spider_ins = await PostgresqlInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(postgres=postgresql, copy={"size": 4}),
+            target_db=TargetDB.POSTGRES,
+            before_stop=before_stop,
+        )
+        assert "Success batch copy 4 rows into POSTGRES" in caplog.text
+        assert "Success batch copy 2 rows into POSTGRES" in caplog.text
+        count = await spider_ins.postgres_manager.count(
+            spider_ins.postgres_model.select()
+        )
+        assert count == 10
+        await PostgresqlInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(postgres=postgresql, copy={"size": 4}),
+            target_db=TargetDB.POSTGRES,
+            filters="url",
+            before_stop=before_stop,
+        )
+        assert "was filtered by filters" in caplog.text
+        count = await spider_ins.postgres_manager.count(
+            spider_ins.postgres_model.select()
+        )
+        assert count == 10
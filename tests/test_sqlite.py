@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+from peewee import CharField, DateField, FloatField
+from peewee import OperationalError as PeeweeOperationalError
+from pymysql import OperationalError
+from schema import SchemaError
+
+from benchmarks.write_path import SCENARIOS, run_all
+from ruia_peewee_async import (
+    RuiaPeeweeInsert,
+    RuiaPeeweeUpdate,
+    TargetDB,
+    _unavailable,
+    after_start,
+    before_stop,
+)
+from ruia_peewee_async.buffer import UpdateBuffer
+from ruia_peewee_async.spool import Spool
+from ruia_peewee_async.sqlite import SqliteManager
+
+from .common import Insert, Update
+
+
+class SQLiteInsert(Insert):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, target_db=TargetDB.SQLITE, **kwargs)
+
+
+class SQLiteUpdate(Update):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, target_db=TargetDB.SQLITE, **kwargs)
+
+
+class SQLiteModels(SQLiteInsert):
+    async def parse(self, response):
+        async for item in super().parse(response):
+            yield RuiaPeeweeInsert(
+                {"title": item.data["title"]}, TargetDB.SQLITE, model="listing"
+            )
+            yield RuiaPeeweeUpdate(
+                {"url": item.data["url"]},
+                {"title": item.data["title"]},
+                TargetDB.SQLITE,
+                not_update_when_exists=False,
+                model="detail",
+            )
+
+
+def basic_setup(sqlite):
+    sqlite.update(
+        {
+            "model": {
+                "table_name": "ruia_sqlite",
+                "title": CharField(),
+                "url": CharField(),
+            }
+        }
+    )
+    return sqlite
+
+
+class TestSQLite:
+    async def test_sqlite_insert(self, sqlite, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite={**sqlite, "commit_size": 4}),
+            before_stop=before_stop,
+        )
+        assert spider_ins.sqlite_model.select().count() == 10
+        assert spider_ins.sqlite_manager.commits == 3
+        journal_mode = spider_ins.sqlite_db.execute_sql("PRAGMA journal_mode")
+        assert journal_mode.fetchone()[0] == "wal"
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite, batch={"size": 3}),
+            filters="url",
+            before_stop=before_stop,
+        )
+        assert "was filtered by filters" in caplog.text
+        assert spider_ins.sqlite_model.select().count() == 10
+
+    async def test_sqlite_batch_errors(self, sqlite, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        sqlite["model"].update(
+            {"table_name": "ruia_sqlite_unique", "url": CharField(unique=True)}
+        )
+        spider_ins = SQLiteInsert(loop=event_loop, is_async_start=True)
+        await after_start(
+            sqlite=sqlite, batch={"size": 3, "max_latency": 0.05}, filter_cache={}
+        )(spider_ins)
+        model = spider_ins.sqlite_model
+
+        async def insert(data, filters=None):
+            await spider_ins.process_callback_result(
+                RuiaPeeweeInsert(data, TargetDB.SQLITE, filters=filters)
+            )
+
+        for url in ("a", "b", "a"):
+            await insert({"title": url, "url": url})
+        assert model.select().count() == 2
+        assert "data: {'title': 'a', 'url': 'a'} error" in caplog.text
+        # Flushed by the timer.
+        await insert({"title": "c", "url": "c"})
+        await insert({"title": "c", "url": "c"})
+        await asyncio.sleep(0.1)
+        assert model.select().count() == 3
+        # A row that wasn't written doesn't filter the next ones out.
+        await insert({"url": "d"}, "url")
+        assert spider_ins.insert_buffers[("sqlite", model)].is_pending(
+            {"url": "d"}, ["url"]
+        )
+        await asyncio.sleep(0.1)
+        await insert({"title": "d", "url": "d"}, "url")
+        await before_stop(spider_ins)
+        await spider_ins.request_session.close()
+        assert model.select().count() == 4
+        # Only the row that was written is cached.
+        cache = spider_ins.filter_caches[("sqlite", model)]
+        assert len(cache) == 1
+        assert cache.seen({"url": "d"}, ["url"])
+        assert "Task exception was never retrieved" not in caplog.text
+
+    async def test_sqlite_bloom_filter(self, sqlite, event_loop):
+        sqlite = basic_setup(sqlite)
+        sqlite["model"].update(
+            {"table_name": "ruia_sqlite_bloom", "price": FloatField()}
+        )
+        data = {"title": "a", "url": "a", "price": 1}
+        for options in ({}, {"bloom": {"filters": "price"}}):
+            spider_ins = SQLiteInsert(loop=event_loop, is_async_start=True)
+            await after_start(sqlite=sqlite, **options)(spider_ins)
+            # Read back as 1.0, the Bloom filter still knows the key.
+            await spider_ins.process_callback_result(
+                RuiaPeeweeInsert(data, TargetDB.SQLITE, filters="price")
+            )
+            await before_stop(spider_ins)
+            await spider_ins.request_session.close()
+        assert spider_ins.sqlite_model.select().count() == 1
+
+    async def test_sqlite_filter_batch(self, sqlite, event_loop):
+        sqlite = basic_setup(sqlite)
+        sqlite["model"].update(
+            {"table_name": "ruia_sqlite_lookup", "url": CharField(null=True)}
+        )
+        spider_ins = SQLiteInsert(loop=event_loop, is_async_start=True)
+        await after_start(sqlite=sqlite, filter_batch={"window": 0.01})(spider_ins)
+        for data in ({"title": "a", "url": None}, {"title": "b", "url": "b"}) * 2:
+            await spider_ins.process_callback_result(
+                RuiaPeeweeInsert(data, TargetDB.SQLITE, filters="url")
+            )
+        await before_stop(spider_ins)
+        await spider_ins.request_session.close()
+        assert spider_ins.sqlite_model.select().count() == 2
+        lookup = spider_ins.filter_lookups[
+            ("sqlite", spider_ins.sqlite_model, ("url",))
+        ]
+        assert (lookup.lookups, lookup.queries) == (2, 2)
+
+    async def test_sqlite_update(self, sqlite, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        spider_ins = await SQLiteUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite),
+            before_stop=before_stop,
+        )
+        assert "but success created" in caplog.text
+        spider_ins = await SQLiteUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite, update_batch={"size": 4}),
+            not_update_when_exists=False,
+            create_when_not_exists=False,
+            before_stop=before_stop,
+        )
+        model = spider_ins.sqlite_model
+        assert model.select().count() == 10
+        assert model.select().where(model.url == "http://testing.com").count() == 10
+
+    async def test_sqlite_update_batch_create(self, sqlite, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        sqlite["model"].update(
+            {"table_name": "ruia_sqlite_update_batch", "price": FloatField()}
+        )
+        spider_ins = SQLiteUpdate(loop=event_loop, is_async_start=True)
+        await after_start(sqlite=sqlite, update_batch={"size": 3}, summary={})(
+            spider_ins
+        )
+        model = spider_ins.sqlite_model
+        model.insert_many(
+            [{"title": "old", "url": url, "price": 1} for url in ("a", "b")]
+        ).execute()
+        # The updates don't carry the NOT NULL price, only the missing row needs it.
+        for url in ("a", "b", "c"):
+            await spider_ins.process_callback_result(
+                RuiaPeeweeUpdate(
+                    {"title": "new"},
+                    {"url": url},
+                    TargetDB.SQLITE,
+                    not_update_when_exists=False,
+                )
+            )
+        assert "batch update 2 rows into SQLITE, 1 rows failed" in caplog.text
+        await before_stop(spider_ins)
+        await spider_ins.request_session.close()
+        assert [row.title for row in model.select().order_by(model.url)] == [
+            "new",
+            "new",
+        ]
+        assert spider_ins.reporter.totals[("SQLITE", "failed")] == 1
+
+    async def test_sqlite_update_batch_cancel(self, sqlite, event_loop):
+        sqlite = basic_setup(sqlite)
+        spider_ins = SQLiteUpdate(loop=event_loop, is_async_start=True)
+        await after_start(sqlite=sqlite)(spider_ins)
+        blocked = asyncio.Event()
+
+        class BlockedManager:
+            async def execute(self, _query):
+                await blocked.wait()
+
+        buffer = UpdateBuffer(
+            BlockedManager(),
+            spider_ins.sqlite_model,
+            "SQLITE",
+            spider_ins.logger,
+            ["url"],
+            ["title"],
+        )
+        await buffer.add({"url": "a", "title": "1"})
+        await buffer.add({"url": "b", "title": "1"})
+        flush = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        await buffer.add({"url": "b", "title": "2"})
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        # The rows put back are merged with the ones added during the flush.
+        await buffer.add({"url": "a", "title": "3"})
+        assert buffer.rows == [{"url": "a", "title": "3"}, {"url": "b", "title": "2"}]
+        blocked.set()
+        assert await buffer.flush() == 2
+        await before_stop(spider_ins)
+        await spider_ins.request_session.close()
+
+    async def test_sqlite_upsert(self, sqlite, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        sqlite["model"].update(
+            {"table_name": "ruia_sqlite_upsert", "title": CharField(unique=True)}
+        )
+        for _ in range(2):
+            spider_ins = await SQLiteUpdate.async_start(
+                loop=event_loop,
+                after_start=after_start(sqlite=sqlite, upsert=True),
+                not_update_when_exists=False,
+                yield_origin=True,
+                before_stop=before_stop,
+            )
+        assert "Upserted" in caplog.text
+        assert spider_ins.sqlite_model.select().count() == 10
+        # Neither created nor updated, nothing is sent.
+        spider_ins = await SQLiteUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite, upsert=True, summary={}),
+            create_when_not_exists=False,
+            before_stop=before_stop,
+        )
+        assert spider_ins.reporter.totals == {("SQLITE", "skipped"): 10}
+
+    async def test_sqlite_spool_replay(self, sqlite, tmp_path, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        path = str(tmp_path / "spool")
+        spool = Spool(path, logging.getLogger("spool"), fsync="always")
+        spool.append(("insert", "sqlite", {"title": "a", "url": "http://a.com"}, None))
+        spool.append(
+            (
+                "result",
+                None,
+                RuiaPeeweeInsert(
+                    {"title": "b", "url": "http://b.com"}, TargetDB.SQLITE
+                ),
+            )
+        )
+        spool.close()
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite, spool={"path": path}),
+            before_stop=before_stop,
+        )
+        assert "replayed 2 spooled records" in caplog.text
+        assert spider_ins.sqlite_model.select().count() == 12
+        assert len(spider_ins.spool) == 0
+        assert not os.path.exists(path + ".replay")
+        # A record failing for good is dropped, an unavailable database stops the replay.
+        spool = Spool(path, logging.getLogger("spool"), fsync="always")
+        for record in ("unknown column", "written", "lost connection", "pending"):
+            spool.append((record,))
+        errors = {
+            "unknown column": OperationalError(1054, "Unknown column 'nope'"),
+            "lost connection": OperationalError(2013, "Lost connection"),
+        }
+
+        async def apply(record):
+            if record[0] in errors:
+                error = errors[record[0]]
+                raise PeeweeOperationalError(error, *error.args)
+
+        assert await spool.replay(apply, _unavailable) == 1
+        assert spool.pending == 2
+        assert "dropped the spooled record ('unknown column',)" in caplog.text
+        spool.close()
+
+    async def test_sqlite_retry(
+        self, sqlite, tmp_path, event_loop, caplog, monkeypatch
+    ):
+        sqlite = basic_setup(sqlite)
+        create = SqliteManager.create
+        calls = []
+
+        async def flaky_create(self, model, **data):
+            calls.append(data)
+            if len(calls) % 2:
+                raise OperationalError(1205, "Lock wait timeout exceeded")
+            return await create(self, model, **data)
+
+        monkeypatch.setattr(SqliteManager, "create", flaky_create)
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                sqlite=sqlite, retry={"attempts": 3, "base": 0.001}
+            ),
+            before_stop=before_stop,
+        )
+        assert spider_ins.sqlite_model.select().count() == 10
+        assert spider_ins.retry_policy.retries == 10
+        assert "retried 10 database calls" in caplog.text
+
+        async def failing_create(_self, _model, **data):
+            calls.append(data)
+            raise OperationalError(2013, "Lost connection to server during query")
+
+        monkeypatch.setattr(SqliteManager, "create", failing_create)
+        calls.clear()
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                sqlite=sqlite,
+                circuit_breaker={"threshold": 2, "reset": 60},
+                spool={"path": str(tmp_path / "spool")},
+            ),
+            before_stop=before_stop,
+        )
+        # The breaker opens after two failures, the other writes aren't sent.
+        assert len(calls) == 2
+        assert spider_ins.breakers["sqlite"].state == "open"
+        assert "SQLITE circuit breaker opened" in caplog.text
+        assert len(spider_ins.spool) == 10
+
+    async def test_sqlite_shard_errors(self, sqlite, event_loop, caplog, monkeypatch):
+        sqlite = basic_setup(sqlite)
+
+        async def failing_create(*_args, **_kwargs):
+            raise OperationalError(2013, "Lost connection to server during query")
+
+        monkeypatch.setattr(SqliteManager, "create", failing_create)
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                sqlite=sqlite, sharding={"key": "url", "tables": 2}, summary={}
+            ),
+            before_stop=before_stop,
+        )
+        # The errors are logged and counted under the shard written to.
+        totals = spider_ins.reporter.totals
+        assert set(totals) == {("SQLITE_0", "failed"), ("SQLITE_1", "failed")}
+        assert sum(totals.values()) == 10
+        assert "<RuiaPeeweeAsync: SQLITE_0 insert data" in caplog.text
+        assert "<RuiaPeeweeAsync: SQLITE insert data" not in caplog.text
+
+    async def test_sqlite_templates(self, sqlite, event_loop, caplog):
+        sqlite = basic_setup(sqlite)
+        sqlite["model"]["added"] = DateField(default=date.today)
+        spider_ins = await SQLiteInsert.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite, sql_templates={}),
+            before_stop=before_stop,
+        )
+        model = spider_ins.sqlite_model
+        assert model.select().where(model.added == date.today()).count() == 10
+        assert spider_ins.sql_templates.stats() == {
+            "size": 1,
+            "hits": 9,
+            "misses": 1,
+            "hit_rate": 0.9,
+        }
+        spider_ins = await SQLiteUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(sqlite=sqlite, sql_templates={"size": 8}),
+            not_update_when_exists=False,
+            before_stop=before_stop,
+        )
+        model = spider_ins.sqlite_model
+        assert model.select().count() == 10
+        assert model.select().where(model.url == "http://testing.com").count() == 10
+        assert spider_ins.sql_templates.stats()["hits"] == 9
+        assert "SQL templates: {'size': 1" in caplog.text
+
+    async def test_sqlite_models(self, sqlite, event_loop):
+        sqlite = basic_setup(sqlite)
+        sqlite["models"] = {
+            "listing": {"table_name": "ruia_listing", "title": CharField()},
+            "detail": {
+                "table_name": "ruia_detail",
+                "title": CharField(unique=True),
+                "url": CharField(),
+            },
+        }
+        spider_ins = await SQLiteModels.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                sqlite=sqlite,
+                batch={"size": 3},
+                update_batch={"size": 3},
+                filter_cache={"size": 100},
+            ),
+            before_stop=before_stop,
+        )
+        backend = spider_ins.backends["sqlite"]
+        listing, detail = backend.models["listing"], backend.models["detail"]
+        assert spider_ins.sqlite_model.select().count() == 0
+        assert listing.select().count() == 10
+        assert detail.select().count() == 10
+        assert set(spider_ins.insert_buffers) == {("sqlite", listing)}
+        assert {key[:2] for key in spider_ins.update_buffers} == {("sqlite", detail)}
+
+    async def test_sqlite_profile(self, sqlite, event_loop, caplog, tmp_path):
+        caplog.set_level(logging.INFO)
+        stages = []
+
+        @contextmanager
+        def hook(stage, database):
+            stages.append((stage, database))
+            yield
+
+        sqlite = basic_setup(sqlite)
+        path = str(tmp_path / "write.pstats")
+        spider_ins = await SQLiteUpdate.async_start(
+            loop=event_loop,
+            after_start=after_start(
+                sqlite=sqlite,
+                profile={"hooks": [hook], "start": True, "items": 5, "path": path},
+            ),
+            not_update_when_exists=False,
+            before_stop=before_stop,
+        )
+        stats = spider_ins.profiler.stats()
+        assert set(stats) == {"item", "validation", "lookup", "write", "logging"}
+        assert stats["item"]["count"] == 10
+        assert stats["write"]["count"] == 10
+        assert stats["item"]["total"] >= stats["write"]["total"]
+        assert ("write", "sqlite") in stages and ("item", None) in stages
+        assert spider_ins.profiler.runs == 1
+        assert os.path.exists(f"{path}.1")
+        assert "profile run 1 saved to" in caplog.text
+        assert "item stage: {'count': 10" in caplog.text
+
+    async def test_sqlite_benchmark(self):
+        report = await run_all(SCENARIOS, 20, 4, 0.0, {"sql_templates": {}})
+        assert list(report) == list(SCENARIOS)
+        for result in report.values():
+            assert result["items_per_sec"] > 0
+            assert result["p50_ms"] <= result["p99_ms"]
+            assert result["alloc_peak_kib"] > 0
+
+    async def test_sqlite_config(self, sqlite):
+        with pytest.raises(SchemaError) as se1:
+            after_start(sqlite={**basic_setup(sqlite), "commit_size": 0})
+        assert "commit_size" in se1.value.args[0]
+        with pytest.raises(SchemaError) as se2:
+            after_start(sqlite=sqlite, spool={"path": "spool", "fsync": "sometimes"})
+        assert "Key 'spool' error" in se2.value.args[0]
+        with pytest.raises(SchemaError) as se3:
+            after_start(
+                sqlite={**sqlite, "models": {"a-b": {"table_name": "ab"}}},
+            )
+        assert "models" in se3.value.args[0]